@@ -11,18 +11,23 @@ This pipeline implements:
 - Instruction-following format conversion
 """
 
-import json
+import hashlib
 import os
 import re
 import random
 import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional, Union
-from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
+from dataclasses import asdict, dataclass
+from functools import lru_cache
 import logging
 
 import numpy as np
-from datasets import Dataset, DatasetDict
+import orjson
+from datasets import Dataset, DatasetDict, Features, Sequence, Value, load_dataset
 from transformers import (
     AutoTokenizer, 
     DataCollatorWithPadding,
@@ -35,14 +40,46 @@ from tqdm import tqdm
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default worker count for Dataset.map() and session loading
+DEFAULT_NUM_PROC = min(os.cpu_count() or 1, 16)
+
+# Whitespace-delimited word matcher used for exchange length filtering
+_WORD_RE = re.compile(r'\S+')
+
+# Compact on-disk schema for tokenized examples. Llama 3.1's 128,256-token
+# vocab fits in uint32 (Arrow would otherwise default to int64) and the
+# attention mask is 0/1.
+TOKENIZED_FEATURES = Features({
+    'input_ids': Sequence(Value('uint32')),
+    'attention_mask': Sequence(Value('uint8')),
+    'token_count': Value('int32')
+})
+
+# Tokenized schema when sequences are padded to length buckets; token_count
+# keeps the unpadded length
+BUCKETED_FEATURES = Features({**TOKENIZED_FEATURES, 'bucket': Value('int32')})
+
+# Schema of instruction examples streamed into Dataset.from_generator()
+INSTRUCTION_FEATURES = Features({
+    'input': Value('string'),
+    'output': Value('string'),
+    'session_id': Value('string'),
+    'chunk_index': Value('int32'),
+    'exchanges': Value('int32'),
+    'exchange_count': Value('int32'),
+    'actual_exchanges': Value('int32')
+})
+
 @dataclass
 class ProcessingConfig:
     """Configuration for data processing pipeline."""
     # Model and tokenization
     model_name: str = "meta-llama/Llama-3.1-8B-Instruct"
     max_length: int = 2048  # Maximum sequence length
-    padding: str = "max_length"
+    padding: str = "longest"  # Padding happens per batch in DataCollatorWithPadding
     truncation: bool = True
+    pack_sequences: bool = False  # Concatenate examples into full max_length blocks (no padding)
+    length_buckets: Tuple[int, ...] = ()  # Right-pad each sequence to the smallest bucket that fits (empty = no padding)
     
     # Session chunking
     max_session_exchanges: int = 300  # Split sessions longer than this
@@ -52,6 +89,15 @@ class ProcessingConfig:
     min_exchange_length: int = 1      # Minimum words per exchange
     max_exchange_length: int = 200    # Maximum words per exchange
     
+    # Example sampling
+    seed: Optional[int] = None        # Seed for random example start positions (None = unseeded)
+    split_seed: int = 42              # Seed for the train/validation/test shuffle (fixed so splits are reproducible)
+    
+    # Parallelism
+    num_proc: int = DEFAULT_NUM_PROC  # Worker processes
+    map_batch_size: int = 2000        # Examples per Dataset.map() batch
+    io_queue_depth: int = 64          # Concurrent file reads when loading single-process
+    
     # Output format
     instruction_template: str = ""  # No instruction - just client-therapist conversation pattern
     
@@ -59,6 +105,54 @@ class ProcessingConfig:
     input_data_dir: str = "data/training_data"
     output_dir: str = "data/processed"
     cache_dir: str = ".cache"
+    reuse_processed_cache: bool = True  # Skip every stage when config and inputs are unchanged
+    
+    # Output format: "parquet" (one zstd-compressed file per split) or "arrow" (save_to_disk)
+    save_format: str = "parquet"
+    
+    def __post_init__(self):
+        # Fixed-length padding bloats the saved dataset and every training batch
+        if self.padding == "max_length":
+            raise ValueError(
+                "padding='max_length' is not supported; sequences are padded "
+                "dynamically by DataCollatorWithPadding"
+            )
+        if self.pack_sequences and self.length_buckets:
+            raise ValueError("pack_sequences and length_buckets cannot be combined")
+        self.length_buckets = tuple(sorted(self.length_buckets))
+
+@dataclass
+class SessionView:
+    """
+    Structure-of-arrays view of a session's dialogue.
+    
+    Speaker labels, messages and length checks are computed once per session so
+    filtering and example creation work on index arrays instead of re-reading
+    the exchange dicts at every stage.
+    """
+    speakers: np.ndarray      # Cleaned speaker label per exchange (None if skipped)
+    messages: np.ndarray      # Raw message text per exchange
+    within_length: np.ndarray # True where the message's word count is within the limits
+    is_therapist: np.ndarray  # True where the cleaned speaker is the therapist
+    
+    def __len__(self) -> int:
+        return len(self.messages)
+    
+    def take(self, indices: np.ndarray) -> "SessionView":
+        """Return a view restricted to the given exchange indices."""
+        return SessionView(
+            speakers=self.speakers[indices],
+            messages=self.messages[indices],
+            within_length=self.within_length[indices],
+            is_therapist=self.is_therapist[indices]
+        )
+    
+    def formatted_lines(self) -> List[Optional[str]]:
+        """Per-exchange "Speaker: message" lines (None for skipped speakers)."""
+        return [
+            f"{speaker}: {message}" if speaker is not None else None
+            for speaker, message in zip(self.speakers, self.messages)
+        ]
 
 class TherapyDataProcessor:
     """
@@ -71,6 +165,7 @@ class TherapyDataProcessor:
         self.config = config
         self.tokenizer = None
         self.data_collator = None
+        self._rng = np.random.default_rng(config.seed)
         
         # Create output directories
         os.makedirs(config.output_dir, exist_ok=True)
@@ -84,16 +179,9 @@ class TherapyDataProcessor:
         """
         logger.info(f"Loading tokenizer for {self.config.model_name}")
         
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            self.config.model_name,
-            cache_dir=self.config.cache_dir,
-            trust_remote_code=True
-        )
+        self._set_tokenizer_parallelism()
+        self.tokenizer = _load_pretrained_tokenizer(self.config.model_name, self.config.cache_dir)
         
-        # Set pad token if not exists
-        if self.tokenizer.pad_token is None:
-            self.tokenizer.pad_token = self.tokenizer.eos_token
-            
         # Configure data collator for dynamic padding
         self.data_collator = DataCollatorWithPadding(
             tokenizer=self.tokenizer,
@@ -113,33 +201,40 @@ class TherapyDataProcessor:
         """
         logger.info(f"Loading therapy sessions from {self.config.input_data_dir}")
         
-        sessions = []
-        data_path = Path(self.config.input_data_dir)
-        
-        # Process all JSON files in subdirectories
-        for json_file in data_path.rglob("*.json"):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Extract dialogue from various possible structures
-                dialogue = self._extract_dialogue(data)
-                if dialogue:
-                    session = {
-                        'session_id': self._extract_session_id(data, json_file),
-                        'dialogue': dialogue,
-                        'source_file': str(json_file)
-                    }
-                    sessions.append(session)
-                    
-            except Exception as e:
-                logger.warning(f"Error loading {json_file}: {e}")
-                continue
+        sessions = list(self.iter_therapy_sessions())
         
         logger.info(f"Loaded {len(sessions)} therapy sessions")
         return sessions
     
-    def _extract_dialogue(self, data: Dict) -> Optional[List[Dict]]:
+    def _find_session_files(self) -> List[Path]:
+        """Find all JSON session files under the input directory."""
+        return list(Path(self.config.input_data_dir).rglob("*.json"))
+    
+    def iter_therapy_sessions(self, json_files: Optional[List[Path]] = None) -> Iterator[Dict]:
+        """
+        Yield therapy sessions one at a time as their files are decoded.
+        
+        Args:
+            json_files: Files to load (defaults to every JSON file in the input directory)
+        """
+        if json_files is None:
+            json_files = self._find_session_files()
+        
+        # Read and decode files across worker processes
+        if self.config.num_proc > 1 and len(json_files) > 1:
+            with ProcessPoolExecutor(max_workers=self.config.num_proc) as executor:
+                for session in executor.map(_load_session_file, json_files, chunksize=32):
+                    if session:
+                        yield session
+        else:
+            # Keep several reads in flight on a thread pool and decode here
+            for json_file, raw in _read_files_ahead(json_files, self.config.io_queue_depth):
+                session = _parse_session_file(json_file, raw)
+                if session:
+                    yield session
+    
+    @staticmethod
+    def _extract_dialogue(data: Dict) -> Optional[List[Dict]]:
         """Extract dialogue from various JSON structures."""
         if isinstance(data, list):
             return data
@@ -151,7 +246,8 @@ class TherapyDataProcessor:
             return data['messages']
         return None
     
-    def _extract_session_id(self, data: Dict, file_path: Path) -> str:
+    @staticmethod
+    def _extract_session_id(data: Dict, file_path: Path) -> str:
         """Extract or generate session ID."""
         if isinstance(data, dict) and 'metadata' in data:
             return data['metadata'].get('session_id', file_path.stem)
@@ -170,21 +266,59 @@ class TherapyDataProcessor:
         Returns:
             Filtered list of exchanges
         """
-        filtered = []
+        view = self._preprocess_session(exchanges)
+        return [exchanges[i] for i in np.flatnonzero(self._length_mask(view))]
+    
+    def _preprocess_session(self, dialogue: List[Dict]) -> SessionView:
+        """
+        Build the structure-of-arrays view of a session in a single pass.
         
-        for exchange in exchanges:
-            if not isinstance(exchange, dict) or 'message' not in exchange:
+        Args:
+            dialogue: List of dialogue exchanges
+            
+        Returns:
+            SessionView over the exchanges
+        """
+        min_words = self.config.min_exchange_length
+        max_words = self.config.max_exchange_length
+        speakers = []
+        messages = []
+        within_length = []
+        
+        for exchange in dialogue:
+            message = exchange.get('message') if isinstance(exchange, dict) else None
+            
+            # Exchanges without a message are dropped by the length filter, so
+            # their speaker is never cleaned
+            if not isinstance(message, str):
+                speakers.append(None)
+                messages.append('')
+                within_length.append(False)
                 continue
-                
-            message = exchange['message'].strip()
-            word_count = len(message.split())
             
-            # Apply length filters
-            if (word_count >= self.config.min_exchange_length and 
-                word_count <= self.config.max_exchange_length):
-                filtered.append(exchange)
-        
-        return filtered
+            speakers.append(self._clean_speaker_name(exchange.get('speaker', 'Unknown')))
+            messages.append(message)
+            
+            # A message with any non-space character has at least one word and
+            # at most (len + 1) // 2, so most short messages need no exact count
+            if (min_words <= 1 and (len(message) + 1) // 2 <= max_words and
+                message and not message.isspace()):
+                within_length.append(True)
+            else:
+                word_count = len(_WORD_RE.findall(message))
+                within_length.append(min_words <= word_count <= max_words)
+        
+        speakers = np.array(speakers, dtype=object)
+        return SessionView(
+            speakers=speakers,
+            messages=np.array(messages, dtype=object),
+            within_length=np.array(within_length, dtype=bool),
+            is_therapist=(speakers == "Therapist")
+        )
+    
+    def _length_mask(self, view: SessionView) -> np.ndarray:
+        """Boolean mask of exchanges within the configured word-count limits."""
+        return view.within_length
     
     def chunk_long_sessions(self, sessions: List[Dict]) -> List[Dict]:
         """
@@ -200,28 +334,29 @@ class TherapyDataProcessor:
         """
         logger.info("Processing session-level chunking...")
         
-        chunked_sessions = []
+        chunked_sessions = list(self.iter_session_chunks(sessions))
         
+        logger.info(f"Created {len(chunked_sessions)} session chunks from {len(sessions)} original sessions")
+        return chunked_sessions
+    
+    def iter_session_chunks(self, sessions: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield short sessions intact and long sessions as overlapping chunks."""
         for session in sessions:
             dialogue = session['dialogue']
             num_exchanges = len(dialogue)
             
             if num_exchanges <= self.config.max_session_exchanges:
                 # Keep short sessions intact
-                chunked_sessions.append(session)
+                yield session
             else:
                 # Split long sessions with overlap
                 logger.info(f"Splitting session {session['session_id']} ({num_exchanges} exchanges)")
                 
-                chunks = self._split_session_with_overlap(
+                yield from self._split_session_with_overlap(
                     session, 
                     self.config.max_session_exchanges,
                     self.config.overlap_percentage
                 )
-                chunked_sessions.extend(chunks)
-        
-        logger.info(f"Created {len(chunked_sessions)} session chunks from {len(sessions)} original sessions")
-        return chunked_sessions
     
     def _split_session_with_overlap(self, session: Dict, max_exchanges: int, overlap_pct: float) -> List[Dict]:
         """
@@ -236,15 +371,9 @@ class TherapyDataProcessor:
             List of session chunks
         """
         dialogue = session['dialogue']
-        overlap_size = int(max_exchanges * overlap_pct)
-        step_size = max_exchanges - overlap_size
-        
         chunks = []
-        start_idx = 0
         
-        while start_idx < len(dialogue):
-            end_idx = min(start_idx + max_exchanges, len(dialogue))
-            
+        for start_idx, end_idx in self._chunk_ranges(len(dialogue), max_exchanges, overlap_pct):
             chunk_dialogue = dialogue[start_idx:end_idx]
             
             chunk_session = {
@@ -261,13 +390,24 @@ class TherapyDataProcessor:
             }
             
             chunks.append(chunk_session)
+        
+        return chunks
+    
+    @staticmethod
+    def _chunk_ranges(num_exchanges: int, max_exchanges: int, overlap_pct: float) -> Iterator[Tuple[int, int]]:
+        """Yield (start, end) exchange ranges of overlapping chunks covering a session."""
+        overlap_size = int(max_exchanges * overlap_pct)
+        step_size = max_exchanges - overlap_size
+        start_idx = 0
+        
+        while start_idx < num_exchanges:
+            end_idx = min(start_idx + max_exchanges, num_exchanges)
+            yield start_idx, end_idx
             
             # Move to next chunk
-            if end_idx >= len(dialogue):
+            if end_idx >= num_exchanges:
                 break
             start_idx += step_size
-        
-        return chunks
     
     def convert_to_instruction_format(self, sessions: List[Dict]) -> List[Dict]:
         """
@@ -277,41 +417,121 @@ class TherapyDataProcessor:
         """
         logger.info("Converting to instruction-following format...")
         print(f"Converting {len(sessions)} sessions to instruction format...")
-        print("This may take a few minutes...")
-        print("Progress will be shown below:")
-        print("-" * 50)
         
         formatted_sessions = []
         
-        for i, session in enumerate(sessions):
-            # Show progress every 10 sessions
-            if i % 10 == 0 or i == len(sessions) - 1:
-                progress = (i + 1) / len(sessions) * 100
-                bar_length = 40
-                filled_length = int(bar_length * (i + 1) // len(sessions))
-                bar = '#' * filled_length + '-' * (bar_length - filled_length)
-                print(f'\rConverting: |{bar}| {progress:.1f}% ({i + 1}/{len(sessions)})', end='', flush=True)
-            dialogue = session['dialogue']
-            
-            # Filter exchanges
-            filtered_dialogue = self.filter_exchanges(dialogue)
-            
-            if len(filtered_dialogue) < 2:  # Need at least 2 exchanges
-                continue
-            
-            # Convert to instruction format
-            instruction_examples = self._create_instruction_examples(
-                filtered_dialogue, 
-                session['session_id']
-            )
-            
-            formatted_sessions.extend(instruction_examples)
+        for session in tqdm(sessions, desc="Converting to instructions"):
+            formatted_sessions.extend(self._session_to_examples(session))
         
-        print()  # New line after progress bar
         logger.info(f"Created {len(formatted_sessions)} instruction examples")
         return formatted_sessions
     
-    def _create_instruction_examples(self, dialogue: List[Dict], session_id: str) -> List[Dict]:
+    def iter_training_chunks(self, view: SessionView, session_id: str) -> Iterator[Tuple[str, SessionView]]:
+        """
+        Chunk and filter a session in a single pass over its SessionView.
+        
+        Chunks are index ranges over the view rather than copied dialogue
+        lists; only chunks with at least 2 exchanges left after length
+        filtering are yielded.
+        
+        Args:
+            view: SessionView of the full (unchunked) session
+            session_id: Session identifier
+            
+        Yields:
+            (chunk session ID, filtered view of the chunk)
+        """
+        num_exchanges = len(view)
+        if num_exchanges <= self.config.max_session_exchanges:
+            # Keep short sessions intact
+            ranges = [(0, num_exchanges)]
+            chunk_ids = [session_id]
+        else:
+            # Split long sessions with overlap
+            logger.info(f"Splitting session {session_id} ({num_exchanges} exchanges)")
+            ranges = list(self._chunk_ranges(
+                num_exchanges,
+                self.config.max_session_exchanges,
+                self.config.overlap_percentage
+            ))
+            chunk_ids = [f"{session_id}_chunk_{i}" for i in range(len(ranges))]
+        
+        valid = self._length_mask(view)
+        
+        for chunk_id, (start_idx, end_idx) in zip(chunk_ids, ranges):
+            keep = start_idx + np.flatnonzero(valid[start_idx:end_idx])
+            if len(keep) >= 2:  # Need at least 2 exchanges
+                yield chunk_id, view.take(keep)
+    
+    def iter_session_examples(self, sessions: Iterable[Dict]) -> Iterator[Dict]:
+        """Yield instruction examples for each raw (unchunked) session as it arrives."""
+        for session in sessions:
+            view = self._preprocess_session(session['dialogue'])
+            for chunk_id, chunk_view in self.iter_training_chunks(view, str(session['session_id'])):
+                yield from self._create_instruction_examples(chunk_view, chunk_id)
+    
+    def _session_to_examples(self, session: Dict) -> List[Dict]:
+        """Filter a session's exchanges and build its instruction examples."""
+        view = self._preprocess_session(session['dialogue'])
+        
+        # Filter exchanges
+        keep = np.flatnonzero(self._length_mask(view))
+        
+        if len(keep) < 2:  # Need at least 2 exchanges
+            return []
+        
+        # Convert to instruction format
+        return self._create_instruction_examples(
+            view.take(keep), 
+            str(session['session_id'])
+        )
+    
+    def _example_generator(self, json_files: List[Path], file_mtimes: List[int]) -> Iterator[Dict]:
+        """
+        Stream files through loading, chunking and instruction conversion.
+        
+        file_mtimes is unused here; it is part of gen_kwargs so the
+        from_generator() cache is invalidated when input files change.
+        """
+        yield from self.iter_session_examples(self.iter_therapy_sessions(json_files))
+    
+    @staticmethod
+    def _generate_examples(config: ProcessingConfig, json_files: Tuple[Path, ...], file_mtimes: Tuple[int, ...]) -> Iterator[Dict]:
+        """
+        from_generator() source for build_instruction_dataset().
+        
+        The builder cache is keyed on a hash of the generator and its kwargs. A
+        bound method would pull in the processor's RNG state, which differs on
+        every unseeded run, so each run would write a fresh, never-reused copy
+        of the examples. Hashing only the config and inputs keeps one cache
+        entry per config and input set (unseeded runs reuse the first sample,
+        as the processed-dataset cache already does).
+        """
+        yield from TherapyDataProcessor(config)._example_generator(json_files, file_mtimes)
+    
+    def build_instruction_dataset(self) -> Dataset:
+        """
+        Build the instruction examples dataset without materializing the
+        intermediate session, chunk and example lists in memory.
+        
+        Returns:
+            Dataset of instruction examples, written incrementally to Arrow
+        """
+        json_files = sorted(self._find_session_files())
+        return Dataset.from_generator(
+            self._generate_examples,
+            features=INSTRUCTION_FEATURES,
+            cache_dir=self.config.cache_dir,
+            # Tuples, not lists: from_generator() shards list kwargs into one
+            # generator call per file, and each call would restart the RNG
+            gen_kwargs={
+                'config': self.config,
+                'json_files': tuple(json_files),
+                'file_mtimes': tuple(path.stat().st_mtime_ns for path in json_files)
+            }
+        )
+    
+    def _create_instruction_examples(self, view: SessionView, session_id: str) -> List[Dict]:
         """
         Create training examples from dialogue using hybrid approach.
         
@@ -327,8 +547,9 @@ class TherapyDataProcessor:
         """
         examples = []
         
-        if not self.tokenizer:
-            self.load_tokenizer()
+        # Format every exchange once; examples are slices of these lines
+        formatted_dialogue = view.formatted_lines()
+        therapist_indices = np.flatnonzero(view.is_therapist)
         
         # Weighted distribution for exchange counts
         exchange_weights = {
@@ -339,92 +560,71 @@ class TherapyDataProcessor:
         }
         
         # Calculate how many examples of each type to create
-        total_examples = min(50, len(dialogue) // 2)  # Limit examples per session
+        total_examples = min(50, len(view) // 2)  # Limit examples per session
         
         for exchange_count, weight in exchange_weights.items():
             num_examples = int(total_examples * weight)
             
-            for _ in range(num_examples):
-                if len(dialogue) < exchange_count + 1:
-                    continue
-                    
-                # Random starting position
-                max_start = len(dialogue) - exchange_count - 1
-                if max_start < 0:
-                    continue
-                    
-                start_idx = random.randint(0, max_start)
+            # Random starting positions, drawn for the whole bucket at once
+            max_start = len(view) - exchange_count - 1
+            if num_examples == 0 or max_start < 0:
+                continue
+            
+            for start_idx in self._rng.integers(0, max_start + 1, size=num_examples).tolist():
                 end_idx = start_idx + exchange_count
                 
-                # Get the chunk starting from minimum size
-                chunk = dialogue[start_idx:end_idx + 1]
-                
                 # Create example ensuring output is therapist response, expanding if needed
                 example = self._create_therapist_output_example_adaptive(
-                    dialogue, start_idx, end_idx, session_id, exchange_count
+                    formatted_dialogue, therapist_indices, start_idx, end_idx,
+                    session_id, exchange_count
                 )
                 if example:
                     examples.append(example)
         
         return examples
     
-    def _create_therapist_output_example_adaptive(self, dialogue: List[Dict], start_idx: int, end_idx: int, session_id: str, min_exchanges: int) -> Optional[Dict]:
-        """Create example ensuring output is always therapist response, expanding if needed."""
+    def _create_therapist_output_example_adaptive(self, formatted_dialogue: List[Optional[str]], therapist_indices: np.ndarray, start_idx: int, end_idx: int, session_id: str, min_exchanges: int) -> Optional[Dict]:
+        """
+        Create example ensuring output is always therapist response, expanding if needed.
         
-        # Start with minimum chunk size and expand until we find therapist response
-        current_end = end_idx
-        max_expand = len(dialogue) - 1
+        Args:
+            formatted_dialogue: Per-exchange "Speaker: message" lines from
+                _format_exchange() (None for skipped speakers)
+            therapist_indices: Sorted indices of therapist exchanges in formatted_dialogue
+        """
+        # Expand to the first therapist response at or after end_idx
+        pos = np.searchsorted(therapist_indices, end_idx, side='left')
+        if pos == len(therapist_indices):
+            # Couldn't find therapist response
+            return None
+        current_end = int(therapist_indices[pos])
         
-        # Try to find a therapist response
-        while current_end <= max_expand:
-            chunk = dialogue[start_idx:current_end + 1]
-            
-            # Format the context
-            chunk_text = self._format_context(chunk)
-            lines = chunk_text.strip().split('\n')
-            
-            if len(lines) < 2:
-                break
-            
-            # Check if last exchange is from therapist
-            last_line = lines[-1]
-            if last_line.startswith('Therapist:'):
-                # Found therapist response! Create example
-                input_lines = lines[:-1]
-                output_line = last_line
-                
-                # Extract just the message (without "Therapist:")
-                output_text = output_line.split(':', 1)[1].strip() if ':' in output_line else output_line
-                input_text = '\n'.join(input_lines)
-                
-                # Calculate token count
-                input_tokens = self.tokenizer.encode(input_text)
-                output_tokens = self.tokenizer.encode(output_text)
-                total_tokens = len(input_tokens) + len(output_tokens)
-                
-                return {
-                    'input': input_text,
-                    'output': output_text,
-                    'session_id': session_id,
-                    'chunk_index': start_idx,
-                    'token_count': total_tokens,
-                    'exchanges': len(chunk),
-                    'exchange_count': min_exchanges,
-                    'actual_exchanges': len(chunk)
-                }
-            
-            # Last exchange is not from therapist, expand by one
-            current_end += 1
+        chunk = formatted_dialogue[start_idx:current_end + 1]
+        lines = [line for line in chunk if line is not None]
         
-        # Couldn't find therapist response
-        return None
+        if len(lines) < 2:
+            return None
+        
+        # Extract just the message (without "Therapist:")
+        output_text = lines[-1].split(':', 1)[1].strip()
+        input_text = '\n'.join(lines[:-1])
+        
+        # token_count is taken from the final tokenize_examples() pass
+        return {
+            'input': input_text,
+            'output': output_text,
+            'session_id': session_id,
+            'chunk_index': start_idx,
+            'exchanges': len(chunk),
+            'exchange_count': min_exchanges,
+            'actual_exchanges': len(chunk)
+        }
     
     def _create_therapist_output_example(self, chunk: List[Dict], session_id: str, start_idx: int, exchange_count: int) -> Optional[Dict]:
         """Create example ensuring output is always therapist response."""
         
         # Format the context
-        chunk_text = self._format_context(chunk)
-        lines = chunk_text.strip().split('\n')
+        lines = self._format_context_lines(chunk)
         
         if len(lines) < 2:
             return None
@@ -448,63 +648,67 @@ class TherapyDataProcessor:
         
         input_text = '\n'.join(input_lines)
         
-        # Calculate token count
-        input_tokens = self.tokenizer.encode(input_text)
-        output_tokens = self.tokenizer.encode(output_text)
-        total_tokens = len(input_tokens) + len(output_tokens)
-        
         return {
             'input': input_text,
             'output': output_text,
             'session_id': session_id,
             'chunk_index': start_idx,
-            'token_count': total_tokens,
             'exchanges': len(chunk),
             'exchange_count': exchange_count
         }
     
-    def _format_context(self, context: List[Dict]) -> str:
-        """Format conversation context as input text."""
-        formatted_lines = []
+    def _format_exchange(self, exchange: Dict) -> Optional[str]:
+        """Format a single exchange as a "Speaker: message" line (None if skipped)."""
+        speaker = exchange.get('speaker', 'Unknown')
+        message = exchange.get('message', '')
         
-        for exchange in context:
-            speaker = exchange.get('speaker', 'Unknown')
-            message = exchange.get('message', '')
-            
-            # Clean speaker name
-            cleaned_speaker = self._clean_speaker_name(speaker)
-            
-            # Skip if speaker was filtered out
-            if cleaned_speaker is None:
-                continue
-            
-            formatted_lines.append(f"{cleaned_speaker}: {message}")
+        # Clean speaker name
+        cleaned_speaker = self._clean_speaker_name(speaker)
+        
+        # Skip if speaker was filtered out
+        if cleaned_speaker is None:
+            return None
         
-        return "\n".join(formatted_lines)
+        return f"{cleaned_speaker}: {message}"
+    
+    def _format_context_lines(self, context: List[Dict]) -> List[str]:
+        """Format conversation context as a list of "Speaker: message" lines."""
+        formatted_lines = (self._format_exchange(exchange) for exchange in context)
+        return [line for line in formatted_lines if line is not None]
     
-    def _clean_speaker_name(self, speaker: str) -> str:
+    def _format_context(self, context: List[Dict]) -> str:
+        """Format conversation context as input text."""
+        return "\n".join(self._format_context_lines(context))
+    
+    # Canonical label for every known speaker alias. Moderators, narrators etc.
+    # should have been filtered out upstream; they (and any unknown speaker not
+    # in this map) resolve to None so they are skipped.
+    _SPEAKER_MAP: Dict[str, Optional[str]] = {
+        **dict.fromkeys(['therapist', 'dr.', 'dr', 'doctor', 'counselor', 'counsellor',
+                         'instructor'], "Therapist"),
+        **dict.fromkeys(['client', 'loretta', 'patient', 'client1', 'client2',
+                         'male participant', 'female participant', 'participant',
+                         'andreas', 'ann larkin', 'betty', 'christina', 'connirae',
+                         'earla', 'heather', 'linda', 'lori', 'lucy', 'marge',
+                         'michelle', 'sarah', 'steve', 'sylvia', 'virginia',
+                         'male speaker', 'male voice', 'unknown woman'], "Client"),
+        **dict.fromkeys(['moderator', 'interviewer', 'narrator', 'unknown speaker',
+                         'unidentified participant'], None),
+    }
+    
+    def _clean_speaker_name(self, speaker: str) -> Optional[str]:
         """Clean and standardize speaker names."""
-        speaker = speaker.lower().strip()
-        
-        # Map various speaker names to standard format
-        if speaker in ['therapist', 'dr.', 'dr', 'doctor', 'counselor', 'counsellor', 'instructor']:
-            return "Therapist"
-        elif speaker in ['client', 'loretta', 'patient', 'client1', 'client2', 
-                        'male participant', 'female participant', 'participant',
-                        'andreas', 'ann larkin', 'betty', 'christina', 'connirae',
-                        'earla', 'heather', 'linda', 'lori', 'lucy', 'marge',
-                        'michelle', 'sarah', 'steve', 'sylvia', 'virginia',
-                        'male speaker', 'male voice', 'unknown woman']:
-            return "Client"
-        elif speaker in ['moderator', 'interviewer', 'narrator', 'unknown speaker', 'unidentified participant']:
-            # These should have been filtered out by the moderator filter
-            # If they still exist, skip them
-            return None
-        else:
-            # Unknown speakers - skip them to be safe
-            return None
+        return self._SPEAKER_MAP.get(speaker.lower().strip())
     
-    def tokenize_examples(self, examples: List[Dict]) -> Dataset:
+    def _set_tokenizer_parallelism(self):
+        """
+        Forked map workers and Rust tokenizer threads contend with each other, so
+        the tokenizer only parallelizes internally when this processor tokenizes
+        in a single process (num_proc <= 1).
+        """
+        os.environ["TOKENIZERS_PARALLELISM"] = "false" if self.config.num_proc > 1 else "true"
+    
+    def tokenize_examples(self, examples: Union[List[Dict], Dataset]) -> Dataset:
         """
         Tokenize examples using HuggingFace Datasets with batched processing.
         
@@ -514,9 +718,12 @@ class TherapyDataProcessor:
         
         if not self.tokenizer:
             self.load_tokenizer()
+        else:
+            # The tokenizer may have been loaded under another processor's config
+            self._set_tokenizer_parallelism()
         
         # Create dataset
-        dataset = Dataset.from_list(examples)
+        dataset = examples if isinstance(examples, Dataset) else Dataset.from_list(examples)
         
         def tokenize_function(examples):
             """
@@ -539,6 +746,10 @@ class TherapyDataProcessor:
                 padding=False,  # We'll use dynamic padding
                 return_tensors=None
             )
+            tokenized["token_count"] = [len(ids) for ids in tokenized["input_ids"]]
+            
+            if self.config.length_buckets:
+                self.pad_to_length_buckets(tokenized)
             
             return tokenized
         
@@ -548,12 +759,7 @@ class TherapyDataProcessor:
         print("Progress tracking enabled - you should see a progress bar below:")
         print("-" * 50)
         
-        # Use tqdm for better progress tracking
-        from tqdm import tqdm
-        import os
-        
-        # Enable progress bars
-        os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        num_proc = self.config.num_proc if self.config.num_proc > 1 else None
         
         print("Setting up tokenization...")
         print("Processing batches...")
@@ -561,7 +767,10 @@ class TherapyDataProcessor:
         tokenized_dataset = dataset.map(
             tokenize_function,
             batched=True,
+            batch_size=self.config.map_batch_size,
+            num_proc=num_proc,
             remove_columns=dataset.column_names,
+            features=self.tokenized_features,
             desc="Tokenizing examples"
         )
         
@@ -570,6 +779,76 @@ class TherapyDataProcessor:
         logger.info(f"Tokenized {len(tokenized_dataset)} examples")
         return tokenized_dataset
     
+    @property
+    def tokenized_features(self) -> Features:
+        """Schema of tokenized examples under the current config."""
+        return BUCKETED_FEATURES if self.config.length_buckets else TOKENIZED_FEATURES
+    
+    def pad_to_length_buckets(self, tokenized: Dict[str, List]) -> Dict[str, List]:
+        """
+        Right-pad a batch of tokenized sequences in place to the smallest
+        configured length bucket that fits each one, and add a 'bucket' column.
+        
+        Training batches drawn from one bucket then share a few fixed shapes,
+        so the GPU allocator can reuse cached blocks. Sequences longer than
+        the largest bucket are left as they are.
+        
+        Args:
+            tokenized: Batch with 'input_ids' and 'attention_mask' lists
+            
+        Returns:
+            The same batch
+        """
+        buckets = self.config.length_buckets
+        pad_id = self.tokenizer.pad_token_id
+        input_ids, attention_mask, bucket_column = [], [], []
+        for ids, mask in zip(tokenized['input_ids'], tokenized['attention_mask']):
+            bucket_idx = bisect_left(buckets, len(ids))
+            bucket = buckets[bucket_idx] if bucket_idx < len(buckets) else len(ids)
+            pad_len = bucket - len(ids)
+            input_ids.append(ids + [pad_id] * pad_len)
+            attention_mask.append(mask + [0] * pad_len)
+            bucket_column.append(bucket)
+        tokenized['input_ids'] = input_ids
+        tokenized['attention_mask'] = attention_mask
+        tokenized['bucket'] = bucket_column
+        return tokenized
+    
+    def pack_examples(self, dataset: Dataset) -> Dataset:
+        """
+        Pack tokenized examples into fixed-length blocks to eliminate padding.
+        
+        All input_ids are concatenated with an EOS token after each example and
+        sliced into blocks of max_length tokens; the trailing partial block is
+        dropped. Every block is full, so the attention mask is all ones.
+        
+        Args:
+            dataset: Tokenized dataset
+            
+        Returns:
+            Dataset of packed blocks with the same columns as the input
+        """
+        if not self.tokenizer:
+            self.load_tokenizer()
+        
+        block_size = self.config.max_length
+        eos_id = np.array([self.tokenizer.eos_token_id], dtype=np.uint32)
+        
+        input_ids = dataset['input_ids']
+        flat_ids = np.concatenate(
+            [np.asarray(ids, dtype=np.uint32) for seq in input_ids for ids in (seq, eos_id)]
+        ) if input_ids else np.empty(0, dtype=np.uint32)
+        
+        num_blocks = len(flat_ids) // block_size
+        blocks = flat_ids[:num_blocks * block_size].reshape(num_blocks, block_size)
+        
+        logger.info(f"Packed {len(dataset)} examples into {num_blocks} blocks of {block_size} tokens")
+        return Dataset.from_dict({
+            'input_ids': blocks.tolist(),
+            'attention_mask': np.ones_like(blocks, dtype=np.uint8).tolist(),
+            'token_count': [block_size] * num_blocks
+        }, features=TOKENIZED_FEATURES)
+    
     def create_train_val_split(self, dataset: Dataset, val_split: float = 0.1, test_split: float = 0.1) -> DatasetDict:
         """
         Create train/validation/test splits.
@@ -590,6 +869,10 @@ class TherapyDataProcessor:
         val_size = int(total_size * val_split)
         train_size = total_size - test_size - val_size
         
+        # Shuffle once (an indices permutation, the Arrow table is untouched)
+        # so session ordering doesn't leak into the splits
+        dataset = dataset.shuffle(seed=self.config.split_seed)
+        
         # Create splits
         train_dataset = dataset.select(range(train_size))
         val_dataset = dataset.select(range(train_size, train_size + val_size))
@@ -618,7 +901,15 @@ class TherapyDataProcessor:
         logger.info(f"Saving processed dataset to {output_path}")
         
         # Save dataset
-        dataset_dict.save_to_disk(output_path)
+        if self.config.save_format == "parquet":
+            os.makedirs(output_path, exist_ok=True)
+            for split_name, split_dataset in dataset_dict.items():
+                split_dataset.to_parquet(
+                    os.path.join(output_path, f"{split_name}.parquet"),
+                    compression="zstd"
+                )
+        else:
+            dataset_dict.save_to_disk(output_path)
         
         # Save tokenizer
         tokenizer_path = os.path.join(output_path, "tokenizer")
@@ -631,8 +922,8 @@ class TherapyDataProcessor:
             'return_tensors': 'pt'
         }
         
-        with open(os.path.join(output_path, "data_collator_info.json"), 'w') as f:
-            json.dump(collator_info, f, indent=2)
+        with open(os.path.join(output_path, "data_collator_info.json"), 'wb') as f:
+            f.write(orjson.dumps(collator_info, option=orjson.OPT_INDENT_2))
         
         logger.info("Dataset saved successfully")
     
@@ -687,69 +978,91 @@ class TherapyDataProcessor:
                 except Exception as e:
                     print(f"  Could not decode: {e}")
     
-    def process_all_data(self) -> DatasetDict:
+    def load_processed_data(self, output_path: str = None) -> DatasetDict:
         """
-        Complete data processing pipeline.
+        Load a dataset previously written by save_processed_data().
         
+        Args:
+            output_path: Path the dataset was saved to
+            
         Returns:
             Processed dataset dictionary
         """
-        logger.info("Starting complete data processing pipeline...")
-        print("\nTHERAPY DATA PROCESSING PIPELINE")
-        print("=" * 50)
+        if output_path is None:
+            output_path = os.path.join(self.config.output_dir, "therapy_dataset")
         
-        # Step 1: Load therapy sessions
-        print("\nSTEP 1: Loading therapy sessions...")
-        start_time = time.time()
-        sessions = self.load_therapy_sessions()
-        step_time = time.time() - start_time
-        print(f"Loaded {len(sessions)} therapy sessions (took {step_time:.1f}s)")
+        logger.info(f"Loading processed dataset from {output_path}")
+        
+        if self.config.save_format == "parquet":
+            data_files = {
+                split: os.path.join(output_path, f"{split}.parquet")
+                for split in ('train', 'validation', 'test')
+            }
+            return load_dataset("parquet", data_files=data_files, cache_dir=self.config.cache_dir)
+        return DatasetDict.load_from_disk(output_path)
+    
+    def _cache_fingerprint(self) -> str:
+        """
+        Hash the config together with the input file paths and mtimes.
         
-        # Show session statistics
-        if sessions:
-            session_lengths = [len(session['dialogue']) for session in sessions]
-            print(f"   Session lengths: {min(session_lengths)}-{max(session_lengths)} exchanges")
-            print(f"   Average session: {sum(session_lengths)/len(session_lengths):.1f} exchanges")
+        Any change to a config field or to the set of session files (added,
+        removed or touched) produces a new fingerprint.
+        """
+        digest = hashlib.sha256(orjson.dumps(asdict(self.config), option=orjson.OPT_SORT_KEYS))
+        for path in sorted(self._find_session_files()):
+            digest.update(f"|{path}:{path.stat().st_mtime_ns}".encode())
+        return digest.hexdigest()
+    
+    def _processed_cache_path(self) -> str:
+        """Location of the cached DatasetDict for the current config and inputs."""
+        return os.path.join(self.config.cache_dir, "processed", self._cache_fingerprint())
+    
+    def process_all_data(self, accelerator=None) -> DatasetDict:
+        """
+        Complete data processing pipeline.
         
-        # Skip showing examples to speed up processing
-        # self._show_random_examples(sessions, "raw_sessions", 2)
-        # self._show_full_examples(sessions, "raw_sessions", 1)
+        Args:
+            accelerator: Optional accelerate.Accelerator. Under a distributed
+                launch only the main process runs the pipeline; the other ranks
+                wait for it and then load the saved dataset.
         
-        # Step 2: Chunk long sessions
-        print(f"\nSTEP 2: Chunking long sessions...")
-        start_time = time.time()
-        chunked_sessions = self.chunk_long_sessions(sessions)
-        step_time = time.time() - start_time
-        print(f"Created {len(chunked_sessions)} session chunks from {len(sessions)} original sessions (took {step_time:.1f}s)")
+        Returns:
+            Processed dataset dictionary
+        """
+        if accelerator is None:
+            return self._run_pipeline()
         
-        # Show chunking statistics
-        if len(chunked_sessions) > len(sessions):
-            print(f"   Split {len(chunked_sessions) - len(sessions)} long sessions")
+        with accelerator.main_process_first():
+            if accelerator.is_main_process:
+                return self._run_pipeline()
+            return self.load_processed_data()
+    
+    def _run_pipeline(self) -> DatasetDict:
+        """Run every pipeline stage and save the result."""
+        cache_path = self._processed_cache_path() if self.config.reuse_processed_cache else None
+        if cache_path and os.path.exists(cache_path):
+            logger.info(f"Config and inputs unchanged, loading cached dataset from {cache_path}")
+            dataset_dict = DatasetDict.load_from_disk(cache_path)
+            # Still write output_dir: it is the pipeline's output, and the other
+            # ranks of a distributed launch load the dataset from there. Saving
+            # includes the tokenizer, which no stage has loaded on this path.
+            if not self.tokenizer:
+                self.load_tokenizer()
+            self.save_processed_data(dataset_dict)
+            return dataset_dict
         
-        # Show random examples
-        # Skip showing examples to speed up processing
-        # self._show_random_examples(chunked_sessions, "chunked_sessions", 2)
-        # self._show_full_examples(chunked_sessions, "chunked_sessions", 1)
+        logger.info("Starting complete data processing pipeline...")
+        print("\nTHERAPY DATA PROCESSING PIPELINE")
+        print("=" * 50)
         
-        # Step 3: Convert to instruction format
-        print(f"\nSTEP 3: Converting to instruction format...")
+        # Steps 1-3: Load therapy sessions, chunk long sessions, convert to instruction format
+        print("\nSTEPS 1-3: Loading, chunking and converting sessions to instruction format...")
+        print("Sessions are streamed straight into an Arrow-backed dataset")
         start_time = time.time()
-        examples = self.convert_to_instruction_format(chunked_sessions)
+        examples = self.build_instruction_dataset()
         step_time = time.time() - start_time
         print(f"Created {len(examples)} training examples (took {step_time:.1f}s)")
         
-        # Show example statistics
-        if examples:
-            token_counts = [ex.get('token_count', 0) for ex in examples if 'token_count' in ex]
-            if token_counts:
-                print(f"   Token counts: {min(token_counts)}-{max(token_counts)} tokens")
-                print(f"   Average tokens: {sum(token_counts)/len(token_counts):.1f}")
-        
-        # Show random examples
-        # Skip showing examples to speed up processing
-        # self._show_random_examples(examples, "instruction_examples", 2)
-        # self._show_full_examples(examples, "instruction_examples", 2)
-        
         # Step 4: Tokenize examples
         print(f"\nSTEP 4: Tokenizing examples...")
         start_time = time.time()
@@ -757,15 +1070,23 @@ class TherapyDataProcessor:
         step_time = time.time() - start_time
         print(f"Tokenized {len(tokenized_dataset)} examples (took {step_time:.1f}s)")
         
-        # Show tokenization sample
+        if self.config.pack_sequences:
+            tokenized_dataset = self.pack_examples(tokenized_dataset)
+            print(f"   Packed into {len(tokenized_dataset)} blocks of {self.config.max_length} tokens")
+        
+        # Show token statistics and tokenization sample
         if len(tokenized_dataset) > 0:
+            token_counts = tokenized_dataset['token_count']
+            print(f"   Token counts: {min(token_counts)}-{max(token_counts)} tokens")
+            print(f"   Average tokens: {sum(token_counts)/len(token_counts):.1f}")
             sample = tokenized_dataset[0]
             print(f"   Sample token count: {len(sample['input_ids'])}")
             print(f"   Sample attention mask length: {len(sample['attention_mask'])}")
         
-        # Show random examples
-        tokenized_list = [dict(tokenized_dataset[i]) for i in range(min(5, len(tokenized_dataset)))]
-        self._show_random_examples(tokenized_list, "tokenized_examples", 2)
+        # Show random examples (DEBUG logging only)
+        if logger.isEnabledFor(logging.DEBUG):
+            tokenized_list = [dict(tokenized_dataset[i]) for i in range(min(5, len(tokenized_dataset)))]
+            self._show_random_examples(tokenized_list, "tokenized_examples", 2)
         
         # Step 5: Create train/val/test splits
         print(f"\nSTEP 5: Creating train/validation/test splits...")
@@ -784,6 +1105,9 @@ class TherapyDataProcessor:
         step_time = time.time() - start_time
         print(f"Data saved to: {self.config.output_dir} (took {step_time:.1f}s)")
         
+        if cache_path:
+            dataset_dict.save_to_disk(cache_path)
+        
         print(f"\nPIPELINE COMPLETED SUCCESSFULLY!")
         print("=" * 50)
         logger.info("Data processing pipeline completed successfully!")
@@ -791,6 +1115,8 @@ class TherapyDataProcessor:
 
     def _show_random_examples(self, data: List[Dict], stage_name: str, max_examples: int = 2) -> None:
         """Show random examples from data at each stage."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         if not data:
             print(f"  No data to show for {stage_name}")
             return
@@ -839,6 +1165,8 @@ class TherapyDataProcessor:
     
     def _show_full_examples(self, data: List[Dict], stage_name: str, max_examples: int = 2) -> None:
         """Show FULL examples from data at each stage for manual verification."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         if not data:
             print(f"  No data to show for {stage_name}")
             return
@@ -892,6 +1220,79 @@ class TherapyDataProcessor:
         print(f"\n{stage_name} examples shown above.")
         print("Proceeding with processing...")
 
+@lru_cache(maxsize=None)
+def _load_pretrained_tokenizer(model_name: str, cache_dir: str) -> PreTrainedTokenizer:
+    """
+    Load a tokenizer once per process; every processor with the same model
+    and cache directory reuses it instead of calling from_pretrained again.
+    """
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        cache_dir=cache_dir,
+        use_fast=True,  # Rust tokenizer: batched calls are encoded in parallel
+        trust_remote_code=True
+    )
+    
+    # Set pad token if not exists
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    
+    return tokenizer
+
+def _read_file_bytes(json_file: Path) -> Optional[bytes]:
+    """Read a file's raw bytes, logging (not raising) on failure."""
+    try:
+        with open(json_file, 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.warning(f"Error loading {json_file}: {e}")
+        return None
+
+def _read_files_ahead(json_files: List[Path], queue_depth: int) -> Iterator[Tuple[Path, Optional[bytes]]]:
+    """
+    Yield (path, bytes) in order while up to queue_depth reads run concurrently.
+    
+    File reads release the GIL, so a small thread pool overlaps the per-file
+    open/read latency; the bounded queue keeps memory proportional to
+    queue_depth rather than to the corpus.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, queue_depth)) as executor:
+        pending = deque()
+        for json_file in json_files:
+            pending.append((json_file, executor.submit(_read_file_bytes, json_file)))
+            if len(pending) >= queue_depth:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+def _load_session_file(json_file: Path) -> Optional[Dict]:
+    """Load a single session file (module-level so worker processes can pickle it)."""
+    return _parse_session_file(json_file, _read_file_bytes(json_file))
+
+def _parse_session_file(json_file: Path, raw: Optional[bytes]) -> Optional[Dict]:
+    """Decode a session file's bytes into a session dict."""
+    if raw is None:
+        return None
+    
+    try:
+        data = orjson.loads(raw)
+        
+        # Extract dialogue from various possible structures
+        dialogue = TherapyDataProcessor._extract_dialogue(data)
+        if dialogue:
+            return {
+                'session_id': TherapyDataProcessor._extract_session_id(data, json_file),
+                'dialogue': dialogue,
+                'source_file': str(json_file)
+            }
+    
+    except Exception as e:
+        logger.warning(f"Error loading {json_file}: {e}")
+    
+    return None
+
 def main():
     """Main function to run the data processing pipeline."""
     
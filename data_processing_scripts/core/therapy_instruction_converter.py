@@ -4,13 +4,40 @@ Convert therapy sessions to instruction format with custom exchange distribution
 This script allows you to specify custom exchange count distributions for different runs.
 """
 
+import os
 import sys
-import json
-import random
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain, islice
 from pathlib import Path
-from therapy_data_pipeline import TherapyDataProcessor, ProcessingConfig
+import numpy as np
+import orjson
+from datasets import Dataset
+from tqdm import tqdm
+from therapy_data_pipeline import TherapyDataProcessor, ProcessingConfig, DEFAULT_NUM_PROC
 import logging
 
+logger = logging.getLogger(__name__)
+
+# Speaker role patterns, matched case-insensitively in a single scan
+_THERAPIST_NAME_RE = re.compile(r'therapist|counselor', re.IGNORECASE)
+_CLIENT_NAME_RE = re.compile(r'client|patient', re.IGNORECASE)
+_THERAPIST_ROLE_RE = re.compile(r'therapist|counselor|doctor|dr\.', re.IGNORECASE)
+
+# Standardized speaker labels, shared by every exchange that maps to them
+THERAPIST_LABEL = sys.intern('Therapist')
+CLIENT_LABEL = sys.intern('Client')
+
+# Outputs starting with these belong to the client and should never occur
+CLIENT_OUTPUT_PREFIXES = ('Client:', 'Patient:')
+CLIENT_PREFIX_WIDTH = max(map(len, CLIENT_OUTPUT_PREFIXES))
+
+# Instruction examples are accumulated column-wise, one list per field
+EXAMPLE_COLUMNS = ('input', 'output', 'session_id', 'start_idx', 'end_idx', 'exchange_count')
+
 def convert_instruction_custom_distribution(input_dir, output_dir, exchange_distribution, run_name="custom"):
     """
     Convert therapy sessions to instruction format with custom exchange distribution.
@@ -58,102 +85,76 @@ def convert_instruction_custom_distribution(input_dir, output_dir, exchange_dist
         # Create processor
         processor = TherapyDataProcessor(config)
         
-        # Step 1: Load therapy sessions from JSON files
-        print("STEP 1: Loading therapy sessions from JSON files...")
-        sessions = load_sessions_from_json(input_dir)
-        print(f"Loaded {len(sessions)} therapy sessions")
-        
-        # Step 2: Chunk long sessions
-        print(f"\nSTEP 2: Chunking long sessions...")
-        
-        # Normalize session structure for the processor
-        normalized_sessions = []
-        for i, session in enumerate(sessions):
-            # Convert 'dialogues' to 'dialogue' if needed
-            if 'dialogues' in session and 'dialogue' not in session:
-                session_copy = session.copy()
-                session_copy['dialogue'] = session_copy['dialogues']
-                # Add required fields if missing
-                if 'session_id' not in session_copy:
-                    session_copy['session_id'] = session.get('file', f'session_{i}')
-                if 'source_file' not in session_copy:
-                    session_copy['source_file'] = session.get('file', f'session_{i}.json')
-                normalized_sessions.append(session_copy)
-            else:
-                # Add required fields if missing
-                if 'session_id' not in session:
-                    session['session_id'] = session.get('file', f'session_{i}')
-                if 'source_file' not in session:
-                    session['source_file'] = session.get('file', f'session_{i}.json')
-                normalized_sessions.append(session)
-        
-        chunked_sessions = processor.chunk_long_sessions(normalized_sessions)
-        print(f"Created {len(chunked_sessions)} session chunks from {len(sessions)} original sessions")
-        
-        # Step 3: Convert to instruction format with custom distribution
-        print(f"\nSTEP 3: Converting to instruction format with custom distribution...")
-        print("This may take a few minutes...")
-        print("Progress will be shown below:")
-        print("-" * 50)
+        # Steps 1-3 are skipped when the inputs and settings are unchanged
+        cache_file = _examples_cache_file(processor, exchange_distribution) if config.reuse_processed_cache else None
+        if cache_file and cache_file.exists():
+            print(f"Inputs unchanged, loading cached instruction examples from {cache_file}")
+            examples = Dataset.from_parquet(str(cache_file), cache_dir=config.cache_dir).to_dict()
+            print(f"Loaded {len(examples['input'])} instruction examples")
+        else:
+            examples = build_instruction_examples(processor, input_dir, exchange_distribution)
+            if cache_file and examples['input']:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                Dataset.from_dict(examples).to_parquet(str(cache_file))
         
-        examples = convert_to_instruction_format_custom(processor, chunked_sessions, exchange_distribution)
-        print(f"\nCreated {len(examples)} instruction examples")
+        num_examples = len(examples['input'])
+        inputs = examples['input']
+        outputs = examples['output']
         
         # Save examples for inspection
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
         
-        # Save all examples
-        examples_file = output_path / f"instruction_examples_{run_name}.json"
-        with open(examples_file, 'w', encoding='utf-8') as f:
-            json.dump(examples, f, indent=2, ensure_ascii=False)
+        # Save all examples as JSONL, one example serialized at a time
+        examples_file = output_path / f"instruction_examples_{run_name}.jsonl"
+        with open(examples_file, 'wb') as f:
+            for example in iter_example_rows(examples):
+                f.write(orjson.dumps(example))
+                f.write(b"\n")
         print(f"Saved all examples to: {examples_file}")
         
         # Save sample examples for inspection
         sample_file = output_path / f"sample_instruction_examples_{run_name}.json"
-        sample_examples = examples[:10]  # First 10 examples
-        with open(sample_file, 'w', encoding='utf-8') as f:
-            json.dump(sample_examples, f, indent=2, ensure_ascii=False)
+        sample_examples = list(iter_example_rows(examples, limit=10))  # First 10 examples
+        with open(sample_file, 'wb') as f:
+            f.write(orjson.dumps(sample_examples, option=orjson.OPT_INDENT_2))
         print(f"Saved sample examples to: {sample_file}")
         
         # Show detailed examples
-        print(f"\nDETAILED EXAMPLES:")
-        print("=" * 50)
-        
-        for i, example in enumerate(examples[:3]):  # Show first 3 examples
-            print(f"\nExample {i+1}:")
-            print(f"  Input: {example['input'][:200]}...")
-            print(f"  Output: {example['output'][:200]}...")
-            print(f"  Full text length: {len(example['input']) + len(example['output'])} characters")
-            print(f"  Exchange count: {example.get('exchange_count', 'N/A')}")
+        # Previews are only printed when running with DEBUG logging
+        if logger.isEnabledFor(logging.DEBUG):
+            print(f"\nDETAILED EXAMPLES:")
+            print("=" * 50)
+            
+            for i, example in enumerate(iter_example_rows(examples, limit=3)):  # Show first 3 examples
+                print(f"\nExample {i+1}:")
+                print(f"  Input: {example['input'][:200]}...")
+                print(f"  Output: {example['output'][:200]}...")
+                print(f"  Full text length: {len(example['input']) + len(example['output'])} characters")
+                print(f"  Exchange count: {example.get('exchange_count', 'N/A')}")
         
         # Analyze distribution
         print(f"\nDISTRIBUTION ANALYSIS:")
         print("=" * 50)
         
         # Count by exchange count
-        exchange_counts = {}
-        for example in examples:
-            count = example.get('exchange_count', 0)
-            exchange_counts[count] = exchange_counts.get(count, 0) + 1
+        exchange_counts = np.bincount(np.asarray(examples['exchange_count'], dtype=np.int64))
         
         print("Examples by exchange count:")
-        for count in sorted(exchange_counts.keys()):
-            percentage = (exchange_counts[count] / len(examples)) * 100
+        for count in np.flatnonzero(exchange_counts).tolist():
+            percentage = (exchange_counts[count] / num_examples) * 100
             print(f"  {count} exchanges: {exchange_counts[count]} ({percentage:.1f}%)")
         
         # Check that all outputs are therapist responses
-        therapist_outputs = 0
-        client_outputs = 0
-        
-        for example in examples[:100]:  # Check first 100
-            output = example.get('output', '')
-            if not any(output.startswith(prefix) for prefix in ['Client:', 'Patient:']):
-                therapist_outputs += 1
-            else:
-                client_outputs += 1
-        
-        print(f"\nOutput validation (first 100 examples):")
+        # Every output is checked; only the leading characters are needed for the prefixes
+        output_heads = np.asarray(outputs, dtype=f'U{CLIENT_PREFIX_WIDTH}')
+        is_client_output = np.zeros(num_examples, dtype=bool)
+        for prefix in CLIENT_OUTPUT_PREFIXES:
+            is_client_output |= np.char.startswith(output_heads, prefix)
+        client_outputs = int(is_client_output.sum())
+        therapist_outputs = num_examples - client_outputs
+        
+        print(f"\nOutput validation (all {num_examples} examples):")
         print(f"  Therapist outputs: {therapist_outputs}")
         print(f"  Client outputs: {client_outputs}")
         
@@ -166,10 +167,18 @@ def convert_instruction_custom_distribution(input_dir, output_dir, exchange_dist
         print(f"\nQUALITY CHECKS:")
         print("=" * 50)
         
-        empty_inputs = sum(1 for ex in examples if not ex['input'].strip())
-        empty_outputs = sum(1 for ex in examples if not ex['output'].strip())
-        very_short = sum(1 for ex in examples if len(ex['input']) + len(ex['output']) < 50)
-        very_long = sum(1 for ex in examples if len(ex['input']) + len(ex['output']) > 2000)
+        # Single pass collecting all four counts
+        empty_inputs = empty_outputs = very_short = very_long = 0
+        for input_text, output_text in zip(inputs, outputs):
+            if not input_text.strip():
+                empty_inputs += 1
+            if not output_text.strip():
+                empty_outputs += 1
+            total_length = len(input_text) + len(output_text)
+            if total_length < 50:
+                very_short += 1
+            elif total_length > 2000:
+                very_long += 1
         
         print(f"Empty inputs: {empty_inputs}")
         print(f"Empty outputs: {empty_outputs}")
@@ -182,7 +191,7 @@ def convert_instruction_custom_distribution(input_dir, output_dir, exchange_dist
             print(f"[WARNING] Some examples have empty input or output!")
         
         print(f"\nCONVERSION COMPLETED SUCCESSFULLY!")
-        print(f"Total examples created: {len(examples)}")
+        print(f"Total examples created: {num_examples}")
         print(f"Examples saved to: {output_dir}")
         
         return True
@@ -192,163 +201,216 @@ def convert_instruction_custom_distribution(input_dir, output_dir, exchange_dist
         logging.exception("Conversion failed")
         return False
 
+def build_instruction_examples(processor, input_dir, exchange_distribution):
+    """Load, chunk and convert sessions into instruction examples (steps 1-3)."""
+    # Step 1: Load therapy sessions from JSON files
+    print("STEP 1: Loading therapy sessions from JSON files...")
+    sessions = load_sessions_from_json(input_dir)
+    print(f"Loaded {len(sessions)} therapy sessions")
+    
+    # Step 2: Chunk long sessions
+    print(f"\nSTEP 2: Chunking long sessions...")
+    
+    # Normalize session structure for the processor
+    normalized_sessions = []
+    for i, session in enumerate(sessions):
+        # Resolve the dialogue key once; everything downstream reads session['dialogue']
+        session_copy = session.copy()
+        session_copy['dialogue'] = session.get('dialogue') or session.get('exchanges') or session.get('dialogues') or []
+        # Give every exchange a 'text' key (older files use 'message')
+        for exchange in session_copy['dialogue']:
+            if 'text' not in exchange:
+                exchange['text'] = exchange.get('message', '')
+        # Add required fields if missing
+        if 'session_id' not in session_copy:
+            session_copy['session_id'] = session.get('file', f'session_{i}')
+        if 'source_file' not in session_copy:
+            session_copy['source_file'] = session.get('file', f'session_{i}.json')
+        normalized_sessions.append(session_copy)
+    
+    chunked_sessions = processor.chunk_long_sessions(normalized_sessions)
+    print(f"Created {len(chunked_sessions)} session chunks from {len(sessions)} original sessions")
+    
+    # Step 3: Convert to instruction format with custom distribution
+    print(f"\nSTEP 3: Converting to instruction format with custom distribution...")
+    print("This may take a few minutes...")
+    print("Progress will be shown below:")
+    print("-" * 50)
+    
+    examples = convert_to_instruction_format_custom(processor, chunked_sessions, exchange_distribution)
+    print(f"\nCreated {len(examples['input'])} instruction examples")
+    
+    return examples
+
+def iter_example_rows(examples, limit=None):
+    """Yield example dicts from the column lists, one row at a time."""
+    rows = zip(*(examples[name] for name in EXAMPLE_COLUMNS))
+    if limit is not None:
+        rows = islice(rows, limit)
+    for row in rows:
+        yield dict(zip(EXAMPLE_COLUMNS, row))
+
+def _examples_cache_file(processor, exchange_distribution):
+    """Parquet cache path keyed by the config, input file mtimes and exchange distribution."""
+    key = processor._cache_fingerprint() + repr(sorted(exchange_distribution.items()))
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return Path(processor.config.cache_dir) / "instructions" / f"{digest}.parquet"
+
 def load_sessions_from_json(input_dir):
     """Load therapy sessions from JSON files in the input directory."""
-    sessions = []
     input_path = Path(input_dir)
     
     if not input_path.exists():
         raise FileNotFoundError(f"Input directory not found: {input_dir}")
     
-    # Get all JSON files
-    json_files = list(input_path.glob("*.json"))
-    json_files.sort()  # Sort for consistent ordering
+    # Get all JSON files; scandir entries carry their file type, so no extra stat per file
+    with os.scandir(input_path) as entries:
+        json_files = sorted(entry.path for entry in entries if entry.name.endswith('.json') and entry.is_file())
     
     print(f"Found {len(json_files)} JSON files")
     
-    for json_file in json_files:
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # Handle different JSON structures
-            if isinstance(data, list):
-                # If it's a list of sessions
-                for session in data:
-                    if 'exchanges' in session or 'dialogue' in session or 'dialogues' in session:
-                        sessions.append(session)
-            elif isinstance(data, dict):
-                # If it's a single session
-                if 'exchanges' in data or 'dialogue' in data or 'dialogues' in data:
-                    sessions.append(data)
-            
-        except Exception as e:
-            print(f"Warning: Could not load {json_file}: {e}")
-            continue
+    # Files are independent: read and decode them across worker processes.
+    # executor.map keeps file order, so the session order stays deterministic.
+    num_workers = min(DEFAULT_NUM_PROC, len(json_files))
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            sessions = list(chain.from_iterable(executor.map(_load_one_json, json_files, chunksize=8)))
+    else:
+        sessions = list(chain.from_iterable(map(_load_one_json, json_files)))
+    
+    return sessions
+
+def _load_one_json(json_file):
+    """Load the sessions contained in one JSON file ([] if it cannot be read)."""
+    sessions = []
+    try:
+        with open(json_file, 'rb') as f:
+            data = orjson.loads(f.read())
+        
+        # Handle different JSON structures
+        if isinstance(data, list):
+            # If it's a list of sessions
+            for session in data:
+                if 'exchanges' in session or 'dialogue' in session or 'dialogues' in session:
+                    sessions.append(session)
+        elif isinstance(data, dict):
+            # If it's a single session
+            if 'exchanges' in data or 'dialogue' in data or 'dialogues' in data:
+                sessions.append(data)
+        
+    except Exception as e:
+        print(f"Warning: Could not load {json_file}: {e}")
     
     return sessions
 
 def convert_to_instruction_format_custom(processor, sessions, exchange_distribution):
-    """Convert sessions to instruction format with custom exchange distribution."""
-    examples = []
+    """
+    Convert sessions to instruction format with custom exchange distribution.
     
-    if not processor.tokenizer:
-        processor.load_tokenizer()
+    Returns a dict of parallel column lists keyed by EXAMPLE_COLUMNS.
+    """
+    examples = {name: [] for name in EXAMPLE_COLUMNS}
     
+    # No tokenizer is loaded here: examples are plain text and are tokenized
+    # exactly once, in the tokenization stage (therapy_tokenizer.py)
     total_sessions = len(sessions)
     
-    for session_idx, session in enumerate(sessions):
-        # Show progress
-        progress = (session_idx + 1) / total_sessions * 100
-        bar_length = 40
-        filled_length = int(bar_length * (session_idx + 1) // total_sessions)
-        bar = '#' * filled_length + '-' * (bar_length - filled_length)
-        print(f'\rProcessing: |{bar}| {progress:.1f}% ({session_idx + 1}/{total_sessions})', end='', flush=True)
-        
-        # Get dialogue from session
-        dialogue = session.get('exchanges', session.get('dialogue', session.get('dialogues', [])))
-        if not dialogue:
-            continue
-        
-        session_id = session.get('session_id', f"session_{session_idx}")
+    # One seed per session keeps sampling reproducible whatever the worker count
+    session_seeds = processor._rng.integers(0, 2**63, size=total_sessions).tolist()
+    process_session = partial(_process_session, exchange_distribution=exchange_distribution)
+    
+    # Sessions are independent: build their examples across worker processes
+    num_workers = min(processor.config.num_proc, total_sessions)
+    with ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else nullcontext() as executor:
+        work = (range(total_sessions), sessions, session_seeds)
+        results = executor.map(process_session, *work, chunksize=16) if executor else map(process_session, *work)
         
-        # Create examples with custom distribution
-        session_examples = create_instruction_examples_custom(processor, dialogue, session_id, exchange_distribution)
-        examples.extend(session_examples)
+        for session_examples in tqdm(results, total=total_sessions, desc="Processing"):
+            for name in EXAMPLE_COLUMNS:
+                examples[name].extend(session_examples[name])
     
-    print()  # New line after progress bar
     return examples
 
-def create_instruction_examples_custom(processor, dialogue, session_id, exchange_distribution):
-    """Create training examples from dialogue using custom exchange distribution."""
-    examples = []
+def _process_session(session_idx, session, seed, exchange_distribution):
+    """Build the example columns for one session (runs in a worker process)."""
+    examples = {name: [] for name in EXAMPLE_COLUMNS}
     
-    # Calculate how many examples of each type to create
-    total_examples = min(50, len(dialogue) // 2)  # Limit examples per session
+    # Get dialogue from session
+    dialogue = session['dialogue']
+    if not dialogue:
+        return examples
     
-    for exchange_count, weight in exchange_distribution.items():
-        num_examples = int(total_examples * weight)
-        
-        for _ in range(num_examples):
-            if len(dialogue) < exchange_count + 1:
-                continue
-                
-            # Random starting position
-            max_start = len(dialogue) - exchange_count - 1
-            if max_start < 0:
-                continue
-                
-            start_idx = random.randint(0, max_start)
-            end_idx = start_idx + exchange_count
-            
-            # Get the chunk starting from minimum size
-            chunk = dialogue[start_idx:end_idx + 1]
-            
-            # Create example ensuring output is therapist response, expanding if needed
-            example = create_therapist_output_example_adaptive(
-                processor, dialogue, start_idx, end_idx, session_id, exchange_count
-            )
-            if example:
-                examples.append(example)
+    session_id = session.get('session_id', f"session_{session_idx}")
     
+    # Create examples with custom distribution
+    rng = np.random.default_rng(seed)
+    create_instruction_examples_custom(rng, dialogue, session_id, exchange_distribution, examples)
     return examples
 
-def create_therapist_output_example_adaptive(processor, dialogue, start_idx, end_idx, session_id, min_exchanges):
-    """Create an example ensuring the output is a therapist response."""
+def create_instruction_examples_custom(rng, dialogue, session_id, exchange_distribution, examples):
+    """Create training examples from dialogue and append them to the example columns."""
+    # Calculate how many examples of each type to create
+    total_examples = min(50, len(dialogue) // 2)  # Limit examples per session
     
-    # Start with the minimum exchanges
-    current_end = end_idx
+    # Classify every speaker once; examples overlap, so each exchange is reused many times
+    cleaned_speakers = [clean_speaker_name(exchange.get('speaker', 'Unknown')) for exchange in dialogue]
+    is_therapist = np.fromiter((is_therapist_speaker(exchange) for exchange in dialogue), dtype=bool, count=len(dialogue))
     
-    # Keep expanding until we get a therapist response
-    while current_end < len(dialogue):
-        chunk = dialogue[start_idx:current_end + 1]
-        
-        # Check if the last exchange is from therapist
-        if chunk and is_therapist_speaker(chunk[-1]):
-            # Create the example
-            input_text = format_dialogue_as_input(chunk[:-1])
-            output_text = format_speaker_output(chunk[-1])
-            
-            return {
-                'input': input_text,
-                'output': output_text,
-                'session_id': session_id,
-                'start_idx': start_idx,
-                'end_idx': current_end,
-                'exchange_count': current_end - start_idx + 1
-            }
-        
-        # Expand by one more exchange
-        current_end += 1
+    # Format every line once; each example is then a slice and a join
+    formatted_lines = [
+        format_speaker_output(exchange, cleaned_speaker)
+        for exchange, cleaned_speaker in zip(dialogue, cleaned_speakers)
+    ]
     
-    return None
-
-def format_dialogue_as_input(context):
-    """Format conversation context as input text."""
-    formatted_lines = []
+    # next_therapist[i] is the first therapist turn at or after i (len(dialogue) if none),
+    # built with one reverse running minimum so example endings are a single lookup
+    num_exchanges = len(dialogue)
+    therapist_positions = np.where(is_therapist, np.arange(num_exchanges), num_exchanges)
+    next_therapist = np.minimum.accumulate(therapist_positions[::-1])[::-1]
     
-    for exchange in context:
-        speaker = exchange.get('speaker', 'Unknown')
-        message = exchange.get('text', exchange.get('message', ''))  # Handle both 'text' and 'message'
-        
-        # Clean speaker name
-        cleaned_speaker = clean_speaker_name(speaker)
+    for exchange_count, weight in exchange_distribution.items():
+        num_examples = int(total_examples * weight)
         
-        # Skip if speaker was filtered out
-        if cleaned_speaker is None:
+        # Random starting positions
+        max_start = len(dialogue) - exchange_count - 1
+        if num_examples <= 0 or max_start < 0:
             continue
-        
-        formatted_lines.append(f"{cleaned_speaker}: {message}")
-    
-    return "\n".join(formatted_lines)
+        start_indices = rng.integers(0, max_start + 1, size=num_examples)
+        
+        # Expand each minimum end to the next therapist turn; starts with no
+        # therapist turn left in the session produce no example
+        end_indices = next_therapist[start_indices + exchange_count]
+        found = end_indices < num_exchanges
+        
+        for start_idx, end_idx in zip(start_indices[found].tolist(), end_indices[found].tolist()):
+            # Create example ensuring output is therapist response
+            input_text, output_text = create_therapist_output_example_adaptive(formatted_lines, start_idx, end_idx)
+            examples['input'].append(input_text)
+            examples['output'].append(output_text)
+            examples['session_id'].append(session_id)
+            examples['start_idx'].append(start_idx)
+            examples['end_idx'].append(end_idx)
+            examples['exchange_count'].append(end_idx - start_idx + 1)
 
-def format_speaker_output(exchange):
-    """Format speaker output."""
-    speaker = exchange.get('speaker', 'Unknown')
-    message = exchange.get('text', exchange.get('message', ''))  # Handle both 'text' and 'message'
+def create_therapist_output_example_adaptive(formatted_lines, start_idx, end_idx):
+    """
+    Create an example whose output is the therapist turn at end_idx.
     
-    # Clean speaker name
-    cleaned_speaker = clean_speaker_name(speaker)
+    end_idx comes from the next-therapist lookup, so the expansion past client
+    turns has already happened. Returns (input_text, output_text).
+    """
+    input_text = format_dialogue_as_input(formatted_lines, start_idx, end_idx)
+    output_text = formatted_lines[end_idx]
+    return input_text, output_text
+
+def format_dialogue_as_input(formatted_lines, start_idx, end_idx):
+    """Join the pre-formatted lines start_idx..end_idx-1 as input text."""
+    # Empty lines belong to speakers that were filtered out
+    return "\n".join(filter(None, formatted_lines[start_idx:end_idx]))
+
+def format_speaker_output(exchange, cleaned_speaker):
+    """Format one exchange as 'Speaker: message' ('' if the speaker was filtered out)."""
+    message = exchange['text']  # Normalized at load time
     
     if cleaned_speaker is None:
         return ""
@@ -357,21 +419,18 @@ def format_speaker_output(exchange):
 
 def clean_speaker_name(speaker):
     """Clean and standardize speaker names."""
-    speaker = speaker.lower().strip()
-    
     # Map various speaker names to standard format
-    if 'therapist' in speaker or 'counselor' in speaker:
-        return 'Therapist'
-    elif 'client' in speaker or 'patient' in speaker:
-        return 'Client'
+    if _THERAPIST_NAME_RE.search(speaker):
+        return THERAPIST_LABEL
+    elif _CLIENT_NAME_RE.search(speaker):
+        return CLIENT_LABEL
     else:
-        # Keep original if not recognized
-        return speaker.title()
+        # Keep original if not recognized; interned so repeated names share one string
+        return sys.intern(speaker.lower().strip().title())
 
 def is_therapist_speaker(exchange):
     """Check if an exchange is from a therapist."""
-    speaker = exchange.get('speaker', '').lower()
-    return any(role in speaker for role in ['therapist', 'counselor', 'doctor', 'dr.', 'therapist:'])
+    return _THERAPIST_ROLE_RE.search(exchange.get('speaker', '')) is not None
 
 def main():
     """Main function."""
@@ -5,13 +5,28 @@ Tokenizes instruction examples with checkpoint system for resuming.
 """
 
 import sys
-import json
 import os
 import signal
+import shutil
+import time
+from collections import deque
+from itertools import count, islice
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+
+import orjson
+from datasets import Dataset
+from tqdm import tqdm
 from therapy_data_pipeline import TherapyDataProcessor, ProcessingConfig
 import logging
 
+# Minimum seconds between checkpoint writes. Shards are written per batch, so a
+# crash between checkpoints only re-tokenizes the batches since the last save.
+CHECKPOINT_INTERVAL = 5.0
+
+# Length buckets used by --pad-to-buckets
+DEFAULT_LENGTH_BUCKETS = (256, 512, 1024, 2048)
+
 class CheckpointManager:
     """Manages checkpoint saving and loading for tokenization."""
     
@@ -29,16 +44,19 @@ class CheckpointManager:
             'last_processed_chunk': chunk_index
         }
         
-        with open(self.checkpoint_file, 'w') as f:
-            json.dump(checkpoint_data, f, indent=2)
+        # Write to a temp file and rename so a crash never leaves a torn checkpoint
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(orjson.dumps(checkpoint_data, option=orjson.OPT_INDENT_2))
+        os.replace(tmp_file, self.checkpoint_file)
         
         print(f"Checkpoint saved: chunk {chunk_index}/{self.total_chunks}")
     
     def load_checkpoint(self):
         """Load previous progress if exists."""
         if os.path.exists(self.checkpoint_file):
-            with open(self.checkpoint_file, 'r') as f:
-                data = json.load(f)
+            with open(self.checkpoint_file, 'rb') as f:
+                data = orjson.loads(f.read())
             
             self.current_chunk = data.get('current_chunk', 0)
             self.total_chunks = data.get('total_chunks', 0)
@@ -51,8 +69,15 @@ class CheckpointManager:
         if os.path.exists(self.checkpoint_file):
             os.remove(self.checkpoint_file)
 
-def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_checkpoint.json"):
-    """Tokenize instruction examples with resume capability."""
+def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_checkpoint.json", num_workers=1, length_buckets=()):
+    """
+    Tokenize instruction examples with resume capability.
+    
+    With num_workers > 1, batches are tokenized and written to their shards by
+    that many worker processes; otherwise the main process tokenizes and the
+    Rust tokenizer parallelizes each batch across threads. With length_buckets,
+    each sequence is right-padded to the smallest bucket that fits it.
+    """
     
     print("STAGE 2: RESUME-CAPABLE TOKENIZATION")
     print("=" * 60)
@@ -72,20 +97,29 @@ def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_c
         max_length=2048,
         input_data_dir="",  # Not needed for this stage
         output_dir=output_dir,
-        cache_dir=".cache"
+        cache_dir=".cache",
+        length_buckets=length_buckets,
+        # Tokenizer threads are used only when batches are tokenized in this
+        # process; worker processes each keep theirs single-threaded
+        num_proc=num_workers
     )
     
     print(f"Input file: {input_file}")
     print(f"Output directory: {output_dir}")
     print()
     
+    # The run scripts call this in-process, so their own interrupt handling is
+    # put back once tokenization is over
+    previous_handlers = {
+        signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)
+    }
+    
     try:
-        # Load instruction examples
-        print("Loading instruction examples...")
-        with open(input_file, 'r', encoding='utf-8') as f:
-            examples = json.load(f)
+        # Examples are streamed batch by batch; only the total is read up front
+        print("Counting instruction examples...")
+        total_examples = count_instruction_examples(input_file)
         
-        print(f"Loaded {len(examples)} instruction examples")
+        print(f"Found {total_examples} instruction examples")
         
         # Create processor
         processor = TherapyDataProcessor(config)
@@ -93,58 +127,77 @@ def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_c
         
         # Setup checkpoint manager
         checkpoint_manager = CheckpointManager(checkpoint_file)
-        checkpoint_manager.total_chunks = len(examples)
+        checkpoint_manager.total_chunks = total_examples
+        
+        # Tokenized batches are streamed to JSONL shards so a resumed run keeps
+        # everything tokenized before the interruption
+        partials_dir = Path(output_dir) / "partials"
         
-        # Try to resume from checkpoint
+        # Process examples in large batches: each is a single parallel tokenizer
+        # call, and batch boundaries only set the checkpoint granularity
+        batch_size = 4096
+        
+        # Try to resume from checkpoint. The shards on disk are the record of
+        # finished work, so shards written after the last checkpoint are kept too.
         start_chunk = 0
         if checkpoint_manager.load_checkpoint():
-            start_chunk = checkpoint_manager.current_chunk
+            start_chunk = find_resume_index(partials_dir, batch_size, total_examples)
             print(f"Resuming from chunk {start_chunk}")
         else:
             print("Starting fresh tokenization")
+            shutil.rmtree(partials_dir, ignore_errors=True)
+        partials_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Index of the first example not yet written to a shard
+        completed = start_chunk
         
         # Setup signal handler for graceful shutdown
         def signal_handler(signum, frame):
             print(f"\nReceived signal {signum}. Saving checkpoint...")
-            checkpoint_manager.save_checkpoint(start_chunk, 0)
+            checkpoint_manager.save_checkpoint(completed, completed)
             print("Checkpoint saved. You can resume later.")
             sys.exit(0)
         
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
         
-        # Process examples in batches
-        batch_size = 100
-        tokenized_examples = []
+        last_save_time = time.monotonic()
         
         print(f"Starting tokenization from chunk {start_chunk}...")
         print("Progress will be shown below:")
         print("-" * 50)
         
-        for i in range(start_chunk, len(examples), batch_size):
-            batch_end = min(i + batch_size, len(examples))
-            batch = examples[i:batch_end]
-            
-            # Show progress
-            progress = (i + 1) / len(examples) * 100
-            bar_length = 40
-            filled_length = int(bar_length * (i + 1) // len(examples))
-            bar = '#' * filled_length + '-' * (bar_length - filled_length)
-            print(f'\rTokenizing: |{bar}| {progress:.1f}% ({i + 1}/{len(examples)})', end='', flush=True)
-            
-            # Tokenize batch
-            batch_tokenized = tokenize_batch(processor, batch)
-            tokenized_examples.extend(batch_tokenized)
-            
-            # Save checkpoint every batch
-            checkpoint_manager.save_checkpoint(batch_end, len(tokenized_examples))
+        batches = iter_instruction_batches(input_file, start_chunk, batch_size)
+        if num_workers > 1:
+            batch_ends = _tokenize_shards_parallel(config, batches, partials_dir, num_workers)
+        else:
+            batch_ends = (tokenize_shard(processor, partials_dir, i, batch) for i, batch in batches)
         
-        print()  # New line after progress bar
+        # Batches finish in order, so every shard before batch_end has been written
+        with tqdm(total=total_examples, initial=start_chunk, unit="ex", smoothing=0, desc="Tokenizing") as progress_bar:
+            for batch_end in batch_ends:
+                progress_bar.update(batch_end - completed)
+                completed = batch_end
+                
+                # Save checkpoint at most every CHECKPOINT_INTERVAL seconds, and after the last batch
+                if time.monotonic() - last_save_time >= CHECKPOINT_INTERVAL or completed == total_examples:
+                    checkpoint_manager.save_checkpoint(completed, completed)
+                    last_save_time = time.monotonic()
         
-        # Create dataset
+        # Create dataset from the shards, in example order
         print("Creating HuggingFace dataset...")
-        from datasets import Dataset
-        dataset = Dataset.from_list(tokenized_examples)
+        partial_files = sorted(str(path) for path in partials_dir.glob("chunk_*.jsonl"))
+        # Rows are streamed from the shards into Arrow in this process: forking a
+        # pool here, after the tokenizer and progress threads have started, can
+        # deadlock. The builder cache is keyed on the shard paths only, so it
+        # lives with the shards and is removed along with them.
+        dataset = Dataset.from_generator(
+            iter_partial_rows,
+            gen_kwargs={"partial_files": partial_files},
+            # Explicit compact schema: no type inference, no int64 columns
+            features=processor.tokenized_features,
+            cache_dir=str(partials_dir / ".cache")
+        )
         
         # Create train/val/test splits
         print("Creating train/validation/test splits...")
@@ -154,11 +207,12 @@ def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_c
         print("Saving processed data...")
         processor.save_processed_data(dataset_dict)
         
-        # Clear checkpoint on successful completion
+        # Clear checkpoint and shards on successful completion
         checkpoint_manager.clear_checkpoint()
+        shutil.rmtree(partials_dir, ignore_errors=True)
         
         print(f"\nSTAGE 2 COMPLETED SUCCESSFULLY!")
-        print(f"Tokenized {len(tokenized_examples)} examples")
+        print(f"Tokenized {len(dataset)} examples")
         print(f"Data saved to: {output_dir}")
         
         return True
@@ -167,55 +221,171 @@ def tokenize_with_resume(input_file, output_dir, checkpoint_file="tokenization_c
         print(f"Error during tokenization: {e}")
         logging.exception("Tokenization failed")
         return False
+    
+    finally:
+        for signum, handler in previous_handlers.items():
+            # None means the handler was not installed from Python; leave it
+            if handler is not None:
+                signal.signal(signum, handler)
+
+def iter_instruction_examples(input_file, start=0):
+    """
+    Stream instruction examples from a JSONL file (one example per line),
+    skipping the first `start` without parsing them. A JSON array file is
+    parsed whole.
+    """
+    if Path(input_file).suffix != '.jsonl':
+        with open(input_file, 'rb') as f:
+            yield from islice(orjson.loads(f.read()), start, None)
+        return
+    with open(input_file, 'rb') as f:
+        lines = (line for line in f if line.strip())
+        for line in islice(lines, start, None):
+            yield orjson.loads(line)
+
+def count_instruction_examples(input_file):
+    """Count instruction examples; JSONL lines are counted without being parsed."""
+    if Path(input_file).suffix != '.jsonl':
+        with open(input_file, 'rb') as f:
+            return len(orjson.loads(f.read()))
+    with open(input_file, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+def iter_instruction_batches(input_file, start, batch_size):
+    """Yield (start_index, examples) batches from example `start` onwards."""
+    examples = iter_instruction_examples(input_file, start)
+    for batch_start in count(start, batch_size):
+        batch = list(islice(examples, batch_size))
+        if not batch:
+            return
+        yield batch_start, batch
+
+def find_resume_index(partials_dir, batch_size, total):
+    """
+    Return the index of the first example not covered by the unbroken run of
+    shards from the start. Shards after a gap (possible when workers finish
+    out of order) are removed so they are rewritten along with the gap.
+    """
+    resume_index = 0
+    for partial_file in sorted(partials_dir.glob("chunk_*.jsonl")):
+        if resume_index < total and int(partial_file.stem.split("_")[1]) == resume_index:
+            resume_index = min(resume_index + batch_size, total)
+        else:
+            partial_file.unlink()
+    return resume_index
+
+def write_partial(partials_dir, start_index, tokenized):
+    """Write one tokenized batch to its own JSONL shard, named by its first example index."""
+    partial_file = partials_dir / f"chunk_{start_index:09d}.jsonl"
+    tmp_file = partial_file.with_suffix(".tmp")
+    # Serialize the whole shard first so it goes out in a single write call
+    payload = b"".join([orjson.dumps(example, option=orjson.OPT_APPEND_NEWLINE) for example in tokenized])
+    with open(tmp_file, 'wb') as f:
+        f.write(payload)
+    # Rename into place so an interrupted write never leaves a partial shard
+    os.replace(tmp_file, partial_file)
+
+def iter_partial_rows(partial_files):
+    """Yield tokenized examples from JSONL shards, in shard order."""
+    for partial_file in partial_files:
+        with open(partial_file, 'rb') as f:
+            for line in f:
+                yield orjson.loads(line)
+
+def tokenize_shard(processor, partials_dir, start_index, batch):
+    """Tokenize one batch, write its shard and return the index after its last example."""
+    write_partial(partials_dir, start_index, tokenize_batch(processor, batch))
+    return start_index + len(batch)
+
+# Per-process processor used by tokenization workers
+_worker_processor = None
+
+def _init_tokenize_worker(config):
+    """Load the tokenizer once per worker process."""
+    global _worker_processor
+    # Only the parent handles interrupts and writes the checkpoint
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker_processor = TherapyDataProcessor(config)
+    _worker_processor.load_tokenizer()
+
+def _tokenize_shard_in_worker(partials_dir, start_index, batch):
+    return tokenize_shard(_worker_processor, partials_dir, start_index, batch)
+
+def _tokenize_shards_parallel(config, batches, partials_dir, num_workers):
+    """
+    Tokenize batches across worker processes, yielding each batch's end index
+    in order. Only a few batches per worker are queued at a time.
+    """
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=_init_tokenize_worker,
+        initargs=(config,)
+    ) as executor:
+        pending = deque()
+        for i, batch in batches:
+            pending.append(executor.submit(_tokenize_shard_in_worker, partials_dir, i, batch))
+            if len(pending) >= 2 * num_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 def tokenize_batch(processor, batch):
     """Tokenize a batch of examples."""
+    # Combine input and output
+    texts = [f"{example['input']}\n\nResponse: {example['output']}" for example in batch]
     
-    def tokenize_function(examples):
-        """Tokenization function for batched processing."""
-        # Combine input and output
-        texts = []
-        for input_text, output in zip(examples['input'], examples['output']):
-            full_text = f"{input_text}\n\nResponse: {output}"
-            texts.append(full_text)
-        
-        # Tokenize
-        tokenized = processor.tokenizer(
-            texts,
-            truncation=processor.config.truncation,
-            max_length=processor.config.max_length,
-            padding=False,
-            return_tensors=None
-        )
-        
-        return tokenized
+    # Example starts are sampled with replacement, so the same text can occur
+    # several times in a batch; tokenize each distinct text only once
+    unique_texts = list(dict.fromkeys(texts))
     
-    # Create temporary dataset for batch processing
-    from datasets import Dataset
-    temp_dataset = Dataset.from_list(batch)
-    
-    # Apply tokenization
-    tokenized_dataset = temp_dataset.map(
-        tokenize_function,
-        batched=True,
-        remove_columns=temp_dataset.column_names,
-        desc="Tokenizing batch"
+    # Tokenize the whole batch in one fast-tokenizer call
+    tokenized = processor.tokenizer(
+        unique_texts,
+        truncation=processor.config.truncation,
+        max_length=processor.config.max_length,
+        padding=False,
+        return_tensors=None
     )
     
-    # Convert to list
-    return [dict(tokenized_dataset[i]) for i in range(len(tokenized_dataset))]
+    # token_count lets training bucket similar lengths into the same batch
+    # (group_by_length) so dynamic padding adds as few pad tokens as possible
+    tokenized['token_count'] = [len(input_ids) for input_ids in tokenized['input_ids']]
+    if processor.config.length_buckets:
+        processor.pad_to_length_buckets(tokenized)
+    
+    columns = list(processor.tokenized_features)
+    encoded = {
+        text: dict(zip(columns, values))
+        for text, *values in zip(unique_texts, *(tokenized[column] for column in columns))
+    }
+    return [encoded[text] for text in texts]
 
 def main():
     """Main function."""
-    if len(sys.argv) != 3:
-        print("Usage: python therapy_tokenizer.py <input_file> <output_dir>")
-        print("Example: python therapy_tokenizer.py ../data/instruction_examples/instruction_examples.json ../data/processed")
+    args = sys.argv[1:]
+    num_workers = 1
+    length_buckets = ()
+    if '--pad-to-buckets' in args:
+        args.remove('--pad-to-buckets')
+        length_buckets = DEFAULT_LENGTH_BUCKETS
+    if '--workers' in args:
+        flag_index = args.index('--workers')
+        try:
+            num_workers = int(args[flag_index + 1])
+        except (IndexError, ValueError):
+            print("--workers expects an integer")
+            sys.exit(1)
+        del args[flag_index:flag_index + 2]
+    
+    if len(args) != 2:
+        print("Usage: python therapy_tokenizer.py <input_file> <output_dir> [--workers N] [--pad-to-buckets]")
+        print("Example: python therapy_tokenizer.py ../data/instruction_examples/instruction_examples.jsonl ../data/processed --workers 8")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    output_dir = sys.argv[2]
+    input_file, output_dir = args
     
-    success = tokenize_with_resume(input_file, output_dir)
+    success = tokenize_with_resume(input_file, output_dir, num_workers=num_workers, length_buckets=length_buckets)
     sys.exit(0 if success else 1)
 
 if __name__ == "__main__":
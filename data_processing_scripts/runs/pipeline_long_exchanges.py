@@ -5,9 +5,16 @@ Run 3: Complete pipeline with long exchanges
 """
 
 import sys
-import subprocess
 from pathlib import Path
 
+# Run the stages in this process instead of spawning an interpreter per stage
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(SCRIPTS_DIR / "core"), str(SCRIPTS_DIR / "validation")]
+
+from therapy_instruction_converter import convert_instruction_custom_distribution
+from therapy_tokenizer import tokenize_with_resume
+from dataset_validator import detailed_validation
+
 def run_complete_pipeline(run_name, exchange_distribution, input_dir, base_output_dir):
     """Run the complete pipeline: instruction conversion + tokenization + validation."""
     
@@ -31,77 +38,36 @@ def run_complete_pipeline(run_name, exchange_distribution, input_dir, base_outpu
     for count, weight in sorted(exchange_distribution.items()):
         print(f"  {weight*100:.0f}% - {count} exchanges")
     
-    # Build command for instruction conversion
-    cmd = [
-        "python", "therapy_instruction_converter.py",
-        input_dir,
-        instruction_output_dir,
-        run_name
-    ]
-    
-    # Add exchange distribution arguments
-    for count, weight in exchange_distribution.items():
-        cmd.append(f"{count}:{weight}")
-    
-    print(f"Running: {' '.join(cmd)}")
-    
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print("✅ Instruction conversion completed successfully!")
-        print(result.stdout)
-    except subprocess.CalledProcessError as e:
+    if not convert_instruction_custom_distribution(input_dir, instruction_output_dir, exchange_distribution, run_name):
         print(f"❌ Instruction conversion failed!")
-        print(f"Error: {e.stderr}")
         return False
+    print("✅ Instruction conversion completed successfully!")
     
     # Step 2: Tokenization
     print(f"\n{'='*60}")
     print("STEP 2: TOKENIZATION")
     print(f"{'='*60}")
     
-    instruction_file = f"{instruction_output_dir}/instruction_examples_{run_name}.json"
+    instruction_file = f"{instruction_output_dir}/instruction_examples_{run_name}.jsonl"
     
     if not Path(instruction_file).exists():
         print(f"❌ Instruction file not found: {instruction_file}")
         return False
     
-    cmd = [
-        "python", "therapy_tokenizer.py",
-        instruction_file,
-        processed_output_dir
-    ]
-    
-    print(f"Running: {' '.join(cmd)}")
-    
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print("✅ Tokenization completed successfully!")
-        print(result.stdout)
-    except subprocess.CalledProcessError as e:
+    if not tokenize_with_resume(instruction_file, processed_output_dir):
         print(f"❌ Tokenization failed!")
-        print(f"Error: {e.stderr}")
         return False
+    print("✅ Tokenization completed successfully!")
     
     # Step 3: Validation
     print(f"\n{'='*60}")
     print("STEP 3: VALIDATION")
     print(f"{'='*60}")
     
-    cmd = [
-        "python", "dataset_validator.py",
-        f"{processed_output_dir}/therapy_dataset"
-    ]
-    
-    print(f"Running: {' '.join(cmd)}")
-    
-    try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print("✅ Validation completed successfully!")
-        print(result.stdout)
-    except subprocess.CalledProcessError as e:
+    if not detailed_validation(f"{processed_output_dir}/therapy_dataset"):
         print(f"❌ Validation failed!")
-        print(f"Error: {e.stderr}")
         return False
+    print("✅ Validation completed successfully!")
     
     # Final summary
     print(f"\n{'='*60}")
@@ -2,49 +2,65 @@
 Universal extraction script for therapy transcripts
 Handles: single sessions, multiple volumes, or series collections
 """
+import html
 import re
-import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
+
+import orjson
+
+# Patterns are compiled once at import rather than looked up on every call
+_DIALOGUE_RE = re.compile(r'<p data-id="[^"]+"><span data-id="[^"]+">([^<]+)</span>')
+# Speaker names are capped in the pattern (under 50 characters once trailing
+# whitespace is dropped), so long all-caps lines without a colon fail fast
+_SPEAKER_RE = re.compile(r'^([A-Z][A-Z\s\.\-\']{1,48}?)\s*:\s*(.+)$')
+_WHITESPACE_RE = re.compile(r'\s+')
+_NEWLINE_RE = re.compile('\n')
+_TITLE_RE = re.compile(r'ucv-section-title[^>]*>(?:<span>)?([^<]+)')
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\s-]')
+# ASCII bytes that pattern drops; bytes.translate deletes them in one C pass
+_UNSAFE_ASCII_BYTES = bytes(c for c in range(128) if _UNSAFE_FILENAME_RE.match(chr(c)))
+
+# Metadata lines to skip, matched in a single scan of each line
+_SKIP_RE = re.compile('|'.join(map(re.escape, [
+    'TRANSCRIPT OF AUDIO',
+    'BEGIN TRANSCRIPT',
+    'END TRANSCRIPT',
+    'INTRODUCTION:',
+    'Print page',
+    '---',
+    'Volume no.'
+])))
 
 def extract_dialogue_from_html(html_text: str) -> List[Dict[str, str]]:
     """Extract speaker-message pairs from HTML paragraphs"""
     dialogues = []
     
     # Find all paragraphs with dialogue
-    pattern = r'<p data-id="[^"]+"><span data-id="[^"]+">([^<]+)</span>'
-    matches = re.findall(pattern, html_text)
+    matches = _DIALOGUE_RE.findall(html_text)
     
     for text in matches:
         text = text.strip()
         
-        # Skip empty lines
-        if not text or ':' not in text:
+        # Skip lines without a speaker separator (covers empty lines too)
+        if ':' not in text:
             continue
         
-        # Skip metadata lines
-        if any(skip in text for skip in [
-            'TRANSCRIPT OF AUDIO',
-            'BEGIN TRANSCRIPT',
-            'END TRANSCRIPT',
-            'INTRODUCTION:',
-            'Print page',
-            '---',
-            'Volume no.'
-        ]):
-            continue
+        # Extract speaker and message; the anchored pattern rejects most
+        # non-dialogue lines before the unanchored metadata scan runs
+        match = _SPEAKER_RE.match(text)
         
-        # Extract speaker and message
-        match = re.match(r'^([A-Z][A-Z\s\.\-\']+?):\s*(.+)$', text)
-        if match:
+        # Skip metadata lines
+        if match and not _SKIP_RE.search(text):
             speaker = match.group(1).strip()
-            message = match.group(2).strip()
             
-            # Clean HTML entities
-            message = clean_html_entities(message)
+            # Clean HTML entities (this also collapses and trims whitespace)
+            message = clean_html_entities(match.group(2))
             
-            # Sanity checks
-            if len(speaker) < 50 and len(message) > 0:
+            # Sanity checks (speaker length is capped by the pattern)
+            if len(message) > 0:
                 dialogues.append({
                     'speaker': speaker,
                     'message': message
@@ -54,42 +70,54 @@ def extract_dialogue_from_html(html_text: str) -> List[Dict[str, str]]:
 
 def clean_html_entities(text: str) -> str:
     """Clean HTML entities from text"""
-    entities = {
-        '&nbsp;': ' ', '&#39;': "'", '&quot;': '"', 
-        '&amp;': '&', '&lt;': '<', '&gt;': '>',
-        '&ndash;': '–', '&mdash;': '—'
-    }
-    for entity, char in entities.items():
-        text = text.replace(entity, char)
+    # One pass over the text that decodes every named and numeric entity
+    # (&nbsp; becomes U+00A0, which the whitespace collapse turns into a space)
+    text = html.unescape(text)
     
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = _WHITESPACE_RE.sub(' ', text).strip()
     return text
 
 def extract_sessions_boundaries(html_text: str) -> List[Tuple[int, int, str]]:
-    """Find session boundaries and titles"""
-    lines = html_text.split('\n')
+    """Find session boundaries (as character offsets into html_text) and titles"""
     sessions = []
     
-    for i, line in enumerate(lines):
-        # Look for END TRANSCRIPT markers
-        if 'END TRANSCRIPT' in line:
-            # Try to find the previous BEGIN TRANSCRIPT or session start
-            start_line = max(0, i - 500)  # Look back up to 500 lines
-            
-            # Extract title from ucv-section-title
-            title = "Unknown Session"
-            for j in range(i, max(0, i-50), -1):
-                title_match = re.search(r'ucv-section-title[^>]*>(?:<span>)?([^<]+)', lines[j])
-                if title_match:
-                    title = clean_html_entities(title_match.group(1))
-                    if 'Series' in title or 'Session' in title or 'Volume' in title:
-                        break
-            
-            sessions.append((start_line, i, title))
+    line_num = 0  # Line number of the current END TRANSCRIPT line
+    scanned = 0   # Offset up to which newlines have been counted
+    # Start offsets of the current line and the 500 before it, filled while
+    # scanning forward so no session walks back through the text
+    line_starts = deque([0], maxlen=501)
+    pos = html_text.find('END TRANSCRIPT')
+    while pos != -1:
+        # Locate the whole line holding the END TRANSCRIPT marker
+        line_start = html_text.rfind('\n', 0, pos) + 1
+        line_end = html_text.find('\n', pos)
+        if line_end == -1:
+            line_end = len(html_text)
+        line_num += html_text.count('\n', scanned, line_start)
+        line_starts.extend(match.end() for match in _NEWLINE_RE.finditer(html_text, scanned, line_start))
+        scanned = line_start
+        
+        # Session text starts up to 500 lines back
+        start = line_starts[-1 - min(line_num, 500)]
+        
+        # Extract title from ucv-section-title in the preceding lines, nearest first
+        title = "Unknown Session"
+        window = []
+        if line_num > 0:
+            window = html_text[line_starts[-min(line_num, 50)]:line_end].split('\n')
+        for line in reversed(window):
+            title_match = _TITLE_RE.search(line)
+            if title_match:
+                title = clean_html_entities(title_match.group(1))
+                if 'Series' in title or 'Session' in title or 'Volume' in title:
+                    break
+        
+        sessions.append((start, line_end, title))
+        pos = html_text.find('END TRANSCRIPT', line_end)
     
     return sessions
 
-def main(input_file: str, output_subdir: str = ""):
+def main(input_file: str, output_subdir: str = "", num_workers: int = 1):
     """Extract transcripts from any HTML file"""
     input_path = Path(input_file)
     
@@ -130,12 +158,27 @@ def main(input_file: str, output_subdir: str = ""):
         extract_single_session(html_text, output_dir, input_path.stem)
     else:
         # Multiple sessions - extract each
-        extract_multiple_sessions(html_text, output_dir)
+        extract_multiple_sessions(html_text, output_dir, num_workers)
+
+def main_batch(input_dir: str, output_subdir: str = "", num_workers: int = 1):
+    """
+    Extract every file in a directory in one process, so the compiled patterns
+    are reused. With output_subdir, each file goes to output_subdir/<file stem>.
+    """
+    input_paths = sorted(path for path in Path(input_dir).glob('*') if path.is_file())
+    
+    if not input_paths:
+        print(f"[ERROR] No files found in: {input_dir}")
+        return
+    
+    for input_path in input_paths:
+        file_subdir = f"{output_subdir}/{input_path.stem}" if output_subdir else ""
+        main(str(input_path), file_subdir, num_workers)
 
 def extract_single_session(html_text: str, output_dir: Path, file_id: str):
     """Extract a single session"""
     # Extract title
-    title_match = re.search(r'ucv-section-title[^>]*>(?:<span>)?([^<]+)', html_text)
+    title_match = _TITLE_RE.search(html_text)
     title = clean_html_entities(title_match.group(1)) if title_match else "Unknown Session"
     
     # Extract dialogues
@@ -154,64 +197,108 @@ def extract_single_session(html_text: str, output_dir: Path, file_id: str):
     }
     
     # Save files
-    safe_title = re.sub(r'[^\w\s-]', '', title)[:50].strip().replace(' ', '_')
+    safe_title = _safe_filename(title)
     save_session(output_dir, safe_title, metadata, dialogues)
     
     print(f"  [OK] Extracted session: {title}")
     print(f"       Exchanges: {len(dialogues)}")
 
-def extract_multiple_sessions(html_text: str, output_dir: Path):
-    """Extract multiple sessions"""
+def extract_multiple_sessions(html_text: str, output_dir: Path, num_workers: int = 1):
+    """
+    Extract multiple sessions. With num_workers > 1, sessions are extracted
+    and saved by that many worker processes.
+    """
     sessions = extract_sessions_boundaries(html_text)
-    lines = html_text.split('\n')
+    
+    tasks = (
+        (idx, html_text[start:end], title, output_dir)
+        for idx, (start, end, title) in enumerate(sessions, 1)
+    )
     
     summary = []
     
-    for idx, (start, end, title) in enumerate(sessions, 1):
+    results = _map_sessions(tasks, num_workers)
+    for (idx, (_, _, title)), entry in zip(enumerate(sessions, 1), results):
         print(f"\nSession {idx}: {title[:60]}...")
         
-        # Extract session text
-        session_text = '\n'.join(lines[start:end+1])
-        
-        # Extract dialogues
-        dialogues = extract_dialogue_from_html(session_text)
-        
-        if len(dialogues) == 0:
+        if entry is None:
             print(f"  [WARNING] No dialogues extracted")
             continue
         
-        # Create metadata
-        metadata = {
-            'session_id': f"session_{idx:02d}",
-            'title': title,
-            'num_exchanges': len(dialogues),
-            'format': 'series_session'
-        }
-        
-        # Save files
-        safe_title = re.sub(r'[^\w\s-]', '', title)[:50].strip().replace(' ', '_')
-        filename = f"session_{idx:02d}_{safe_title}"
-        save_session(output_dir, filename, metadata, dialogues)
-        
-        print(f"  [OK] {len(dialogues)} exchanges")
-        
-        summary.append({
-            'session_id': idx,
-            'title': title,
-            'exchanges': len(dialogues),
-            'file': f"{filename}.json"
-        })
+        print(f"  [OK] {entry['exchanges']} exchanges")
+        summary.append(entry)
     
     # Save summary
     summary_file = output_dir / "_sessions_summary.json"
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        json.dump(summary, f, indent=2)
+    with open(summary_file, 'wb') as f:
+        f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
     
     print(f"\n{'='*60}")
     print(f"[COMPLETE] Extracted {len(summary)} sessions")
     print(f"Total exchanges: {sum(s['exchanges'] for s in summary)}")
     print(f"Summary: {summary_file}")
 
+def _extract_session(task: Tuple[int, str, str, Path]) -> Optional[Dict]:
+    """
+    Extract and save one session of a multi-session file. Returns its summary
+    entry, or None if no dialogues were found.
+    """
+    idx, session_text, title, output_dir = task
+    
+    # Extract dialogues
+    dialogues = extract_dialogue_from_html(session_text)
+    
+    if len(dialogues) == 0:
+        return None
+    
+    # Create metadata
+    metadata = {
+        'session_id': f"session_{idx:02d}",
+        'title': title,
+        'num_exchanges': len(dialogues),
+        'format': 'series_session'
+    }
+    
+    # Save files
+    safe_title = _safe_filename(title)
+    filename = f"session_{idx:02d}_{safe_title}"
+    save_session(output_dir, filename, metadata, dialogues)
+    
+    return {
+        'session_id': idx,
+        'title': title,
+        'exchanges': len(dialogues),
+        'file': f"{filename}.json"
+    }
+
+def _map_sessions(tasks, num_workers: int) -> List[Optional[Dict]]:
+    """
+    Run _extract_session over tasks and return the results in order. Only a
+    few sessions per worker are queued at a time, and the pool is shut down
+    before returning.
+    """
+    if num_workers <= 1:
+        return list(map(_extract_session, tasks))
+    
+    results = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_extract_session, task))
+            if len(pending) >= 2 * num_workers:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+    return results
+
+def _safe_filename(title: str) -> str:
+    """Reduce a title to a filename-safe stem of at most 50 characters"""
+    if title.isascii():
+        title = title.encode('ascii').translate(None, _UNSAFE_ASCII_BYTES).decode('ascii')
+    else:
+        # Non-ASCII titles keep the regex so Unicode letters survive
+        title = _UNSAFE_FILENAME_RE.sub('', title)
+    return title[:50].strip().replace(' ', '_')
+
 def save_session(output_dir: Path, filename: str, metadata: Dict, dialogues: List[Dict]):
     """Save session in both JSON and JSONL formats"""
     # JSON format
@@ -221,27 +308,44 @@ def save_session(output_dir: Path, filename: str, metadata: Dict, dialogues: Lis
     }
     
     json_file = output_dir / f"{filename}.json"
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    with open(json_file, 'wb') as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
     
     # JSONL format
     jsonl_file = output_dir / f"{filename}.jsonl"
-    with open(jsonl_file, 'w', encoding='utf-8') as f:
-        for dialogue in dialogues:
-            f.write(json.dumps(dialogue, ensure_ascii=False) + '\n')
+    with open(jsonl_file, 'wb') as f:
+        f.write(b"".join([orjson.dumps(dialogue, option=orjson.OPT_APPEND_NEWLINE) for dialogue in dialogues]))
 
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) < 2:
-        print("Usage: python extract_any_transcript.py <input_file> [output_subdir]")
+    args = sys.argv[1:]
+    num_workers = 1
+    if '--workers' in args:
+        flag_index = args.index('--workers')
+        try:
+            num_workers = int(args[flag_index + 1])
+        except (IndexError, ValueError):
+            print("--workers expects an integer")
+            sys.exit(1)
+        del args[flag_index:flag_index + 2]
+    batch = '--dir' in args
+    if batch:
+        args.remove('--dir')
+    
+    if len(args) < 1:
+        print("Usage: python extract_any_transcript.py <input_file> [output_subdir] [--workers N]")
+        print("       python extract_any_transcript.py --dir <input_dir> [output_subdir] [--workers N]")
         print("\nExamples:")
         print("  python extract_any_transcript.py data/transcripts/2.txt sessions")
-        print("  python extract_any_transcript.py data/transcripts/3.txt ellis_collection")
+        print("  python extract_any_transcript.py data/transcripts/3.txt ellis_collection --workers 8")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    output_subdir = sys.argv[2] if len(sys.argv) > 2 else ""
+    input_path = args[0]
+    output_subdir = args[1] if len(args) > 1 else ""
     
-    main(input_file, output_subdir)
+    if batch:
+        main_batch(input_path, output_subdir, num_workers)
+    else:
+        main(input_path, output_subdir, num_workers)
 
@@ -3,14 +3,55 @@ Extract therapy transcripts from plain text files (non-HTML)
 For files like 4.txt and 5.txt that have simple text format
 """
 import re
-import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, islice
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Union
 
-def extract_dialogues_from_plaintext(text: str) -> List[Dict[str, str]]:
-    """Extract speaker-message pairs from plain text"""
+import orjson
+
+# Patterns are compiled once at import rather than looked up on every call
+# Speaker names are capped in the pattern (under 30 characters once trailing
+# whitespace is dropped), so long all-caps lines without a colon fail fast
+_SPEAKER_RE = re.compile(r'^([A-Z][A-Z\s\.\-\']{1,28}?)\s*:\s*(.+)$')
+_SESSION_HEADER_RE = re.compile(r'Session (\d+):\s*(.+)', re.IGNORECASE)
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\s-]')
+# ASCII bytes that pattern drops; bytes.translate deletes them in one C pass
+_UNSAFE_ASCII_BYTES = bytes(c for c in range(128) if _UNSAFE_FILENAME_RE.match(chr(c)))
+
+# Metadata/navigation lines to skip, matched against the lowercased line in a
+# single scan (faster than re.IGNORECASE, which defeats literal prefix search)
+_SKIP_RE = re.compile('|'.join(map(re.escape, [
+    'transcript of',
+    'begin transcript',
+    'end transcript',
+    'skip to main',
+    'you are here',
+    'cite',
+    'email',
+    'embed',
+    'page ',
+    'session ',
+    'client 0',
+    'presented by'
+])))
+
+# Header lines that are never the title (matched against the lowercased line)
+_TITLE_SKIP_RE = re.compile('|'.join(map(re.escape, [
+    'transcript of',
+    'begin transcript',
+    'skip to',
+    'search',
+    'menu',
+    'you are here'
+])))
+
+def extract_dialogues_from_plaintext(lines: Union[str, Iterable[str]]) -> List[Dict[str, str]]:
+    """Extract speaker-message pairs from plain text (a string or an iterable of lines)"""
     dialogues = []
-    lines = text.split('\n')
+    if isinstance(lines, str):
+        lines = lines.split('\n')
     
     for line in lines:
         line = line.strip()
@@ -19,32 +60,20 @@ def extract_dialogues_from_plaintext(text: str) -> List[Dict[str, str]]:
         if not line:
             continue
         
-        # Skip metadata/navigation lines
-        if any(skip in line.lower() for skip in [
-            'transcript of',
-            'begin transcript',
-            'end transcript',
-            'skip to main',
-            'you are here',
-            'cite',
-            'email',
-            'embed',
-            'page ',
-            'session ',
-            'client 0',
-            'presented by'
-        ]):
-            continue
-        
         # Match pattern: SPEAKER: message
         # Can be COUNSELOR:, PATIENT:, THERAPIST:, CLIENT:, etc.
-        match = re.match(r'^([A-Z][A-Z\s\.\-\']+?):\s*(.+)$', line)
-        if match:
+        # The anchored pattern rejects most lines, so only speaker lines are
+        # lowercased and scanned for metadata
+        match = _SPEAKER_RE.match(line)
+        
+        # Skip metadata/navigation lines
+        if match and not _SKIP_RE.search(line.lower()):
             speaker = match.group(1).strip()
-            message = match.group(2).strip()
+            # The line is already stripped and the pattern eats the space after ':'
+            message = match.group(2)
             
-            # Skip if message is too short or speaker name too long
-            if len(message) > 0 and len(speaker) < 30:
+            # Skip if message is empty (speaker length is capped by the pattern)
+            if len(message) > 0:
                 dialogues.append({
                     'speaker': speaker,
                     'message': message
@@ -52,23 +81,17 @@ def extract_dialogues_from_plaintext(text: str) -> List[Dict[str, str]]:
     
     return dialogues
 
-def extract_title_from_plaintext(text: str) -> str:
-    """Extract title from plain text file"""
-    lines = text.split('\n')
+def extract_title_from_plaintext(lines: Union[str, Iterable[str]]) -> str:
+    """Extract title from plain text (a string or an iterable of lines)"""
+    if isinstance(lines, str):
+        lines = lines.split('\n')
     
     # Check first 20 lines for title
-    for line in lines[:20]:
+    for line in islice(lines, 20):
         line = line.strip()
         if len(line) > 10 and len(line) < 150:
             # Skip common headers
-            if any(skip in line.lower() for skip in [
-                'transcript of',
-                'begin transcript',
-                'skip to',
-                'search',
-                'menu',
-                'you are here'
-            ]):
+            if _TITLE_SKIP_RE.search(line.lower()):
                 continue
             
             # Likely a title
@@ -77,17 +100,21 @@ def extract_title_from_plaintext(text: str) -> str:
     
     return "Unknown Session"
 
-def detect_session_boundaries(text: str) -> List[tuple]:
-    """Detect multiple sessions in plain text"""
-    lines = text.split('\n')
+def detect_session_boundaries(lines: Union[str, Iterable[str]]) -> List[tuple]:
+    """Detect multiple sessions in plain text (a string or an iterable of lines)"""
+    if isinstance(lines, str):
+        lines = lines.split('\n')
     sessions = []
     
     current_start = 0
     current_title = "Unknown Session"
+    num_lines = 0
+    line = '\n'  # An empty input still counts as one (empty) line
     
     for i, line in enumerate(lines):
+        num_lines = i + 1
         # Look for session markers
-        session_match = re.match(r'Session (\d+):\s*(.+)', line, re.IGNORECASE)
+        session_match = _SESSION_HEADER_RE.match(line)
         
         if session_match:
             # Save previous session if exists
@@ -98,13 +125,18 @@ def detect_session_boundaries(text: str) -> List[tuple]:
             current_start = i
             current_title = line.strip()
     
+    # Lines read from a file keep their newline; a trailing one ends in an
+    # empty last line, as it does when splitting the text on '\n'
+    if line.endswith('\n'):
+        num_lines += 1
+    
     # Add final session
-    if len(lines) > current_start + 10:
-        sessions.append((current_start, len(lines), current_title))
+    if num_lines > current_start + 10:
+        sessions.append((current_start, num_lines, current_title))
     
     return sessions
 
-def main(input_file: str, output_subdir: str = ""):
+def main(input_file: str, output_subdir: str = "", num_workers: int = 1):
     """Extract transcripts from plain text file"""
     input_path = Path(input_file)
     
@@ -125,24 +157,45 @@ def main(input_file: str, output_subdir: str = ""):
     print(f"Output: {output_dir}")
     print(f"{'='*60}\n")
     
-    # Read file
+    # Stream the file line by line: one pass to find the sessions, a second
+    # to extract them, so the whole transcript is never held in memory
     with open(input_path, 'r', encoding='utf-8', errors='ignore') as f:
-        text = f.read()
+        # Check for multiple sessions
+        sessions = detect_session_boundaries(f)
+        f.seek(0)
+        
+        if len(sessions) > 1:
+            print(f"Detected: {len(sessions)} sessions\n")
+            extract_multiple_sessions(f, sessions, output_dir, num_workers)
+        else:
+            print(f"Detected: Single session\n")
+            extract_single_session(f, output_dir, input_path.stem)
+
+def main_batch(input_dir: str, output_subdir: str = "", num_workers: int = 1):
+    """
+    Extract every file in a directory in one process, so the compiled patterns
+    are reused. With output_subdir, each file goes to output_subdir/<file stem>.
+    """
+    input_paths = sorted(path for path in Path(input_dir).glob('*') if path.is_file())
     
-    # Check for multiple sessions
-    sessions = detect_session_boundaries(text)
+    if not input_paths:
+        print(f"[ERROR] No files found in: {input_dir}")
+        return
     
-    if len(sessions) > 1:
-        print(f"Detected: {len(sessions)} sessions\n")
-        extract_multiple_sessions(text, sessions, output_dir)
-    else:
-        print(f"Detected: Single session\n")
-        extract_single_session(text, output_dir, input_path.stem)
+    for input_path in input_paths:
+        file_subdir = f"{output_subdir}/{input_path.stem}" if output_subdir else ""
+        main(str(input_path), file_subdir, num_workers)
 
-def extract_single_session(text: str, output_dir: Path, file_id: str):
-    """Extract single session from plain text"""
-    title = extract_title_from_plaintext(text)
-    dialogues = extract_dialogues_from_plaintext(text)
+def extract_single_session(lines: Union[str, Iterable[str]], output_dir: Path, file_id: str):
+    """Extract single session from plain text (a string or an iterable of lines)"""
+    if isinstance(lines, str):
+        lines = lines.split('\n')
+    lines = iter(lines)
+    
+    # The title comes from the head of the text; keep those lines for the dialogues
+    head = list(islice(lines, 20))
+    title = extract_title_from_plaintext(head)
+    dialogues = extract_dialogues_from_plaintext(chain(head, lines))
     
     if len(dialogues) == 0:
         print(f"  [WARNING] No dialogues extracted!")
@@ -160,50 +213,111 @@ def extract_single_session(text: str, output_dir: Path, file_id: str):
     print(f"  [OK] {title}")
     print(f"       Exchanges: {len(dialogues)}")
 
-def extract_multiple_sessions(text: str, sessions: List[tuple], output_dir: Path):
-    """Extract multiple sessions from plain text"""
-    lines = text.split('\n')
+def extract_multiple_sessions(lines: Union[str, Iterable[str]], sessions: List[tuple], output_dir: Path, num_workers: int = 1):
+    """
+    Extract multiple sessions from plain text (a string or an iterable of
+    lines). With num_workers > 1, sessions are extracted and saved by that
+    many worker processes.
+    """
+    if isinstance(lines, str):
+        lines = lines.split('\n')
+    
+    tasks = (
+        (idx, session_lines, title, output_dir)
+        for idx, (session_lines, title) in enumerate(_iter_session_lines(lines, sessions), 1)
+    )
     summary = []
     
-    for idx, (start, end, title) in enumerate(sessions, 1):
-        session_text = '\n'.join(lines[start:end])
-        dialogues = extract_dialogues_from_plaintext(session_text)
-        
-        if len(dialogues) == 0:
+    results = _map_sessions(tasks, num_workers)
+    for (idx, (_, _, title)), entry in zip(enumerate(sessions, 1), results):
+        if entry is None:
             print(f"Session {idx}: {title[:50]} - [WARNING] No dialogues")
             continue
         
-        metadata = {
-            'session_id': f"session_{idx:02d}",
-            'title': title,
-            'num_exchanges': len(dialogues),
-            'format': 'plaintext_series'
-        }
-        
-        safe_title = re.sub(r'[^\w\s-]', '', title)[:50].strip().replace(' ', '_')
-        filename = f"session_{idx:02d}_{safe_title}"
-        
-        save_session(output_dir, filename, metadata, dialogues)
-        
         print(f"Session {idx}: {title[:60]}")
-        print(f"  [OK] {len(dialogues)} exchanges")
+        print(f"  [OK] {entry['exchanges']} exchanges")
         
-        summary.append({
-            'session_id': idx,
-            'title': title,
-            'exchanges': len(dialogues),
-            'file': f"{filename}.json"
-        })
+        summary.append(entry)
     
     # Save summary
     summary_file = output_dir / "_sessions_summary.json"
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        json.dump(summary, f, indent=2)
+    with open(summary_file, 'wb') as f:
+        f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
     
     print(f"\n{'='*60}")
     print(f"[COMPLETE] Extracted {len(summary)} sessions")
     print(f"Total exchanges: {sum(s['exchanges'] for s in summary)}")
 
+def _iter_session_lines(lines: Iterable[str], sessions: List[tuple]) -> Iterator[Tuple[List[str], str]]:
+    """Yield each session's lines and title, reading the lines only once"""
+    lines = iter(lines)
+    position = 0  # Index of the next line the iterator yields
+    
+    for start, end, title in sessions:
+        # Sessions are in file order: skip to this one and read just its lines
+        for _ in islice(lines, start - position):
+            pass
+        yield list(islice(lines, end - start)), title
+        position = end
+
+def _extract_session(task: Tuple[int, List[str], str, Path]) -> Optional[Dict]:
+    """
+    Extract and save one session of a multi-session file. Returns its summary
+    entry, or None if no dialogues were found.
+    """
+    idx, session_lines, title, output_dir = task
+    dialogues = extract_dialogues_from_plaintext(session_lines)
+    
+    if len(dialogues) == 0:
+        return None
+    
+    metadata = {
+        'session_id': f"session_{idx:02d}",
+        'title': title,
+        'num_exchanges': len(dialogues),
+        'format': 'plaintext_series'
+    }
+    
+    safe_title = _safe_filename(title)
+    filename = f"session_{idx:02d}_{safe_title}"
+    
+    save_session(output_dir, filename, metadata, dialogues)
+    
+    return {
+        'session_id': idx,
+        'title': title,
+        'exchanges': len(dialogues),
+        'file': f"{filename}.json"
+    }
+
+def _map_sessions(tasks, num_workers: int) -> List[Optional[Dict]]:
+    """
+    Run _extract_session over tasks and return the results in order. Only a
+    few sessions per worker are queued at a time, and the pool is shut down
+    before returning.
+    """
+    if num_workers <= 1:
+        return list(map(_extract_session, tasks))
+    
+    results = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_extract_session, task))
+            if len(pending) >= 2 * num_workers:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+    return results
+
+def _safe_filename(title: str) -> str:
+    """Reduce a title to a filename-safe stem of at most 50 characters"""
+    if title.isascii():
+        title = title.encode('ascii').translate(None, _UNSAFE_ASCII_BYTES).decode('ascii')
+    else:
+        # Non-ASCII titles keep the regex so Unicode letters survive
+        title = _UNSAFE_FILENAME_RE.sub('', title)
+    return title[:50].strip().replace(' ', '_')
+
 def save_session(output_dir: Path, filename: str, metadata: Dict, dialogues: List[Dict]):
     """Save session in JSON and JSONL formats"""
     output = {
@@ -213,24 +327,41 @@ def save_session(output_dir: Path, filename: str, metadata: Dict, dialogues: Lis
     
     # JSON
     json_file = output_dir / f"{filename}.json"
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    with open(json_file, 'wb') as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
     
     # JSONL
     jsonl_file = output_dir / f"{filename}.jsonl"
-    with open(jsonl_file, 'w', encoding='utf-8') as f:
-        for dialogue in dialogues:
-            f.write(json.dumps(dialogue, ensure_ascii=False) + '\n')
+    with open(jsonl_file, 'wb') as f:
+        f.write(b"".join([orjson.dumps(dialogue, option=orjson.OPT_APPEND_NEWLINE) for dialogue in dialogues]))
 
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) < 2:
-        print("Usage: python extract_plaintext_transcripts.py <input_file> [output_subdir]")
+    args = sys.argv[1:]
+    num_workers = 1
+    if '--workers' in args:
+        flag_index = args.index('--workers')
+        try:
+            num_workers = int(args[flag_index + 1])
+        except (IndexError, ValueError):
+            print("--workers expects an integer")
+            sys.exit(1)
+        del args[flag_index:flag_index + 2]
+    batch = '--dir' in args
+    if batch:
+        args.remove('--dir')
+    
+    if len(args) < 1:
+        print("Usage: python extract_plaintext_transcripts.py <input_file> [output_subdir] [--workers N]")
+        print("       python extract_plaintext_transcripts.py --dir <input_dir> [output_subdir] [--workers N]")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    output_subdir = sys.argv[2] if len(sys.argv) > 2 else ""
+    input_path = args[0]
+    output_subdir = args[1] if len(args) > 1 else ""
     
-    main(input_file, output_subdir)
+    if batch:
+        main_batch(input_path, output_subdir, num_workers)
+    else:
+        main(input_path, output_subdir, num_workers)
 
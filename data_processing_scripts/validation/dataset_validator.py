@@ -7,9 +7,20 @@ This helps you understand exactly what the data looks like at each point.
 import sys
 import json
 from pathlib import Path
-from datasets import load_from_disk
+import numpy as np
+from datasets import DatasetDict, load_dataset, load_from_disk
 from transformers import AutoTokenizer, DataCollatorWithPadding
 
+# Leading tokens decoded for the sample text analysis; enough for the previews
+PREVIEW_TOKENS = 256
+
+def load_processed_dataset(data_dir) -> DatasetDict:
+    """Load a processed dataset saved as per-split Parquet files or with save_to_disk."""
+    parquet_files = {path.stem: str(path) for path in sorted(Path(data_dir).glob("*.parquet"))}
+    if parquet_files:
+        return load_dataset("parquet", data_files=parquet_files)
+    return load_from_disk(data_dir)
+
 def detailed_validation(data_dir):
     """Detailed validation with examples at each stage."""
     
@@ -21,7 +32,7 @@ def detailed_validation(data_dir):
     # Load dataset
     print("\n1. LOADING DATASET")
     print("-" * 30)
-    dataset = load_from_disk(data_dir)
+    dataset = load_processed_dataset(data_dir)
     print(f"[OK] Dataset loaded: {len(dataset)} splits")
     
     # Show dataset structure
@@ -78,17 +89,19 @@ def detailed_validation(data_dir):
     # Decode the full sequence
     print(f"\n4. DECODED TEXT ANALYSIS")
     print("-" * 30)
-    full_decoded = tokenizer.decode(input_ids, skip_special_tokens=True)
-    print(f"Full decoded text:")
-    print(f"  Length: {len(full_decoded)} characters")
+    # Only the leading tokens are shown, so only those are decoded
+    preview_decoded = tokenizer.decode(input_ids[:PREVIEW_TOKENS], skip_special_tokens=True)
+    print(f"Decoded text (first {min(PREVIEW_TOKENS, len(input_ids))} of {len(input_ids)} tokens):")
+    print(f"  Length: {len(preview_decoded)} characters")
     print(f"  Content preview:")
-    print(f"  {full_decoded[:300]}...")
+    print(f"  {preview_decoded[:300]}...")
     
-    # Show special tokens in the sequence
+    # Count special tokens directly on the ids
     print(f"\nSpecial tokens in sequence:")
-    bos_count = input_ids.count(tokenizer.bos_token_id) if tokenizer.bos_token_id else 0
-    eos_count = input_ids.count(tokenizer.eos_token_id) if tokenizer.eos_token_id else 0
-    pad_count = input_ids.count(tokenizer.pad_token_id) if tokenizer.pad_token_id else 0
+    ids = np.asarray(input_ids)
+    bos_count = int((ids == tokenizer.bos_token_id).sum()) if tokenizer.bos_token_id is not None else 0
+    eos_count = int((ids == tokenizer.eos_token_id).sum()) if tokenizer.eos_token_id is not None else 0
+    pad_count = int((ids == tokenizer.pad_token_id).sum()) if tokenizer.pad_token_id is not None else 0
     
     print(f"  BOS tokens: {bos_count}")
     print(f"  EOS tokens: {eos_count}")
@@ -98,10 +111,9 @@ def detailed_validation(data_dir):
     print(f"\n5. TOKEN-BY-TOKEN BREAKDOWN")
     print("-" * 30)
     print(f"First 10 tokens with their text:")
-    for i in range(min(10, len(input_ids))):
-        token_id = input_ids[i]
-        token_text = tokenizer.decode([token_id])
-        attention = attention_mask[i]
+    # One vectorized lookup instead of a decode() round-trip per token
+    tokens = tokenizer.convert_ids_to_tokens(input_ids[:10])
+    for i, token_id, token_text, attention in zip(range(10), input_ids[:10], tokens, attention_mask[:10]):
         print(f"  Token {i:2d}: ID={token_id:6d}, Text='{token_text}', Attention={attention}")
     
     # Show instruction format
@@ -109,14 +121,15 @@ def detailed_validation(data_dir):
     print("-" * 30)
     
     # Try to identify instruction structure
-    decoded_parts = full_decoded.split('\n\n')
+    decoded_parts = preview_decoded.split('\n\n')
     if len(decoded_parts) >= 2:
-        print(f"Text appears to be split into {len(decoded_parts)} parts:")
+        more = "+" if len(input_ids) > PREVIEW_TOKENS else ""
+        print(f"Text appears to be split into {len(decoded_parts)}{more} parts:")
         for i, part in enumerate(decoded_parts[:3]):  # Show first 3 parts
             print(f"  Part {i+1}: {part[:100]}...")
     
     # Show conversation structure
-    lines = full_decoded.split('\n')
+    lines = preview_decoded.split('\n')
     print(f"\nConversation structure (first 10 lines):")
     for i, line in enumerate(lines[:10]):
         if line.strip():
@@ -127,24 +140,25 @@ def detailed_validation(data_dir):
     print("-" * 30)
     
     # Token length statistics
-    all_lengths = [len(ex['input_ids']) for ex in dataset['train']]
+    # The tokenizer stage stores each example's length as token_count; only
+    # datasets written before that column existed need it recomputed
+    if 'token_count' in dataset['train'].column_names:
+        all_lengths = np.asarray(dataset['train'].with_format("numpy")['token_count'], dtype=np.int32)
+    else:
+        train_ids = dataset['train']['input_ids']
+        all_lengths = np.fromiter((len(ids) for ids in train_ids), dtype=np.int32, count=len(train_ids))
     print(f"Token length statistics (training set):")
-    print(f"  Min length: {min(all_lengths)}")
-    print(f"  Max length: {max(all_lengths)}")
-    print(f"  Average length: {sum(all_lengths)/len(all_lengths):.1f}")
+    print(f"  Min length: {all_lengths.min()}")
+    print(f"  Max length: {all_lengths.max()}")
+    print(f"  Average length: {all_lengths.mean():.1f}")
     
     # Length distribution
-    length_ranges = [
-        (0, 100, "Very short"),
-        (100, 500, "Short"),
-        (500, 1000, "Medium"),
-        (1000, 1500, "Long"),
-        (1500, float('inf'), "Very long")
-    ]
+    length_labels = ["Very short", "Short", "Medium", "Long", "Very long"]
+    length_edges = np.array([0, 100, 500, 1000, 1500, 2**31 - 1])
+    length_counts, _ = np.histogram(all_lengths, bins=length_edges)
     
     print(f"\nLength distribution:")
-    for min_len, max_len, label in length_ranges:
-        count = sum(1 for length in all_lengths if min_len <= length < max_len)
+    for label, count in zip(length_labels, length_counts):
         percentage = (count / len(all_lengths)) * 100
         print(f"  {label:10s}: {count:4d} examples ({percentage:5.1f}%)")
     
@@ -153,11 +167,11 @@ def detailed_validation(data_dir):
     print("-" * 30)
     print(f"Showing 3 different examples from training set:")
     
-    for i in range(min(3, len(dataset['train']))):
-        example = dataset['train'][i]
-        decoded = tokenizer.decode(example['input_ids'][:100], skip_special_tokens=True)
+    preview_ids = dataset['train'][:3]['input_ids']
+    previews = tokenizer.batch_decode([ids[:100] for ids in preview_ids], skip_special_tokens=True)
+    for i, (ids, decoded) in enumerate(zip(preview_ids, previews)):
         print(f"\nExample {i+1}:")
-        print(f"  Length: {len(example['input_ids'])} tokens")
+        print(f"  Length: {len(ids)} tokens")
         print(f"  Preview: {decoded[:150]}...")
     
     # Test data collator
@@ -192,38 +206,43 @@ def detailed_validation(data_dir):
     print(f"\n10. ENCODE-DECODE CONSISTENCY TEST")
     print("-" * 30)
     try:
-        # Get original text
-        original_text = tokenizer.decode(input_ids, skip_special_tokens=True)
+        # Round-trip a random sample in one batched decode and one batched encode
+        train_size = len(dataset['train'])
+        sample_idx = np.random.default_rng(0).choice(train_size, size=min(1024, train_size), replace=False)
+        sample_ids = dataset['train'].select(sample_idx)[:]['input_ids']
+        print(f"Round-tripping {len(sample_ids)} sampled training examples")
         
-        # Re-encode the decoded text
-        reencoded = tokenizer.encode(original_text, add_special_tokens=True)
+        original_texts = tokenizer.batch_decode(sample_ids, skip_special_tokens=True)
+        reencoded = tokenizer(original_texts, add_special_tokens=True)['input_ids']
         
         # Check if they match
-        if input_ids == reencoded:
+        mismatched = [i for i, (ids, reenc) in enumerate(zip(sample_ids, reencoded)) if ids != reenc]
+        if not mismatched:
             print(f"[OK] Perfect encode-decode match!")
         else:
-            print(f"[WARNING] Encode-decode mismatch!")
-            print(f"  Original length: {len(input_ids)}")
-            print(f"  Re-encoded length: {len(reencoded)}")
-            print(f"  Difference: {len(input_ids) - len(reencoded)} tokens")
+            print(f"[WARNING] Encode-decode mismatch in {len(mismatched)}/{len(sample_ids)} examples!")
             
-            # Show differences
-            min_len = min(len(input_ids), len(reencoded))
-            differences = 0
-            for i in range(min_len):
-                if input_ids[i] != reencoded[i]:
-                    differences += 1
+            # Show differences for the first mismatch
+            original = np.asarray(sample_ids[mismatched[0]])
+            reenc = np.asarray(reencoded[mismatched[0]])
+            print(f"  Original length: {len(original)}")
+            print(f"  Re-encoded length: {len(reenc)}")
+            print(f"  Difference: {len(original) - len(reenc)} tokens")
+            
+            min_len = min(len(original), len(reenc))
+            differences = int((original[:min_len] != reenc[:min_len]).sum())
             print(f"  Token differences: {differences}")
         
         # Test with special tokens
         print(f"\nTesting with special tokens:")
-        original_with_special = tokenizer.decode(input_ids, skip_special_tokens=False)
-        reencoded_with_special = tokenizer.encode(original_with_special, add_special_tokens=False)
+        texts_with_special = tokenizer.batch_decode(sample_ids, skip_special_tokens=False)
+        reencoded_with_special = tokenizer(texts_with_special, add_special_tokens=False)['input_ids']
         
-        if input_ids == reencoded_with_special:
+        special_mismatches = sum(ids != reenc for ids, reenc in zip(sample_ids, reencoded_with_special))
+        if not special_mismatches:
             print(f"[OK] Perfect match with special tokens!")
         else:
-            print(f"[WARNING] Mismatch with special tokens!")
+            print(f"[WARNING] Mismatch with special tokens in {special_mismatches}/{len(sample_ids)} examples!")
         
     except Exception as e:
         print(f"[ERROR] Encode-decode test failed: {e}")
@@ -233,27 +252,33 @@ def detailed_validation(data_dir):
     print(f"\n11. QUALITY CHECKS")
     print("-" * 30)
     
-    # Check for empty sequences
+    # Check for empty sequences and attention mask consistency in one batched
+    # pass per split that only reads the sequence lengths
     empty_sequences = 0
-    for split_name, split_data in dataset.items():
-        for example in split_data:
-            if len(example['input_ids']) == 0:
-                empty_sequences += 1
-    
-    print(f"Empty sequences: {empty_sequences}")
-    
-    # Check attention mask consistency
     inconsistent_masks = 0
     for split_name, split_data in dataset.items():
-        for example in split_data:
-            if len(example['input_ids']) != len(example['attention_mask']):
-                inconsistent_masks += 1
+        # A 0-row split maps to no columns at all, and there is nothing to check
+        if len(split_data) == 0:
+            continue
+        seq_lengths = split_data.map(
+            lambda batch: {
+                'ids_len': [len(ids) for ids in batch['input_ids']],
+                'mask_len': [len(mask) for mask in batch['attention_mask']]
+            },
+            batched=True,
+            remove_columns=split_data.column_names,
+            keep_in_memory=True,
+            desc=f"Checking {split_name}"
+        ).with_format("numpy")[:]
+        empty_sequences += int((seq_lengths['ids_len'] == 0).sum())
+        inconsistent_masks += int((seq_lengths['ids_len'] != seq_lengths['mask_len']).sum())
     
+    print(f"Empty sequences: {empty_sequences}")
     print(f"Inconsistent attention masks: {inconsistent_masks}")
     
     # Check for reasonable token lengths
-    very_short = sum(1 for length in all_lengths if length < 10)
-    very_long = sum(1 for length in all_lengths if length > 2000)
+    very_short = int((all_lengths < 10).sum())
+    very_long = int((all_lengths > 2000).sum())
     
     print(f"Very short sequences (<10 tokens): {very_short}")
     print(f"Very long sequences (>2000 tokens): {very_long}")